@@ -0,0 +1,262 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# batch.py
+# This file has a NumPy version of our complex evaluation for scoring many
+# positions at once, e.g. to label a dataset or to tune the weights. Boards
+# are packed into an (N, 8) array of bitboards, and every feature of
+# Evaluator.features is computed for all N positions with array operations,
+# giving the same scores as Evaluator.evaluate to the last bit.
+# Only this file needs NumPy.
+
+import numpy as np
+import chess
+
+import evaluator
+from evaluator import (PST, MATERIAL_VALUES, TROPISM, TROPISM_WEIGHTS, SHIELD_FRONT, SHIELD_SIDE, SHIELD_BEHIND,
+                       PHASE_WEIGHTS, OPENING, MIDDLEGAME, ENDGAME, CENTIPAWNS_PER_PAWN, MATE_SCORE)
+
+U64 = np.uint64
+
+# columns of a packed board
+PAWNS, KNIGHTS, BISHOPS, ROOKS, QUEENS, KINGS, WHITE, BLACK = range(8)
+
+# a plane per color and piece type: black pawns first, white kings last
+NUM_PLANES = 12
+PLANE_COLORS = [chess.BLACK, chess.WHITE]
+
+
+def plane(color, piece_type):
+    return 6 * color + piece_type - 1
+
+NOT_FILE_A = U64(chess.BB_ALL & ~chess.BB_FILE_A)
+NOT_FILE_H = U64(chess.BB_ALL & ~chess.BB_FILE_H)
+NOT_FILES_AB = U64(chess.BB_ALL & ~(chess.BB_FILE_A | chess.BB_FILE_B))
+NOT_FILES_GH = U64(chess.BB_ALL & ~(chess.BB_FILE_G | chess.BB_FILE_H))
+ALL = U64(chess.BB_ALL)
+
+# moves on the board as (shift, mask of the origins that stay on the board):
+# a positive shift moves up, a negative one down
+ROOK_STEPS = [(8, ALL), (-8, ALL), (1, NOT_FILE_H), (-1, NOT_FILE_A)]
+BISHOP_STEPS = [(9, NOT_FILE_H), (7, NOT_FILE_A), (-7, NOT_FILE_H), (-9, NOT_FILE_A)]
+KNIGHT_STEPS = [(17, NOT_FILE_H), (15, NOT_FILE_A), (10, NOT_FILES_GH), (6, NOT_FILES_AB),
+                (-6, NOT_FILES_GH), (-10, NOT_FILES_AB), (-15, NOT_FILE_H), (-17, NOT_FILE_A)]
+
+# piece-square values and material by plane, signed from white's side
+SIGNED_PST = np.array([[(1 if color else -1) * PST[color][piece_type][square] for square in chess.SQUARES]
+                       for color in PLANE_COLORS for piece_type in chess.PIECE_TYPES], dtype=np.int64)
+SIGNED_MATERIAL = np.array([(1 if color else -1) * MATERIAL_VALUES[piece_type]
+                            for color in PLANE_COLORS for piece_type in chess.PIECE_TYPES], dtype=np.int64)
+
+BITS = np.arange(64, dtype=U64)
+# king tropism distances by piece square and king square
+TROPISM_BY_SQUARE = np.array(TROPISM, dtype=np.int64).T.copy()
+SHIELD_MASKS = [np.array(masks, dtype=U64) for masks in [SHIELD_FRONT, SHIELD_SIDE, SHIELD_BEHIND]]
+
+# the squares of each column of ps_eval (square % 7)
+COLUMN_MASKS = [U64(sum(chess.BB_SQUARES[square] for square in chess.SQUARES if square % 7 == column))
+                for column in range(7)]
+
+M1 = U64(0x5555555555555555)
+M2 = U64(0x3333333333333333)
+M4 = U64(0x0f0f0f0f0f0f0f0f)
+H01 = U64(0x0101010101010101)
+
+
+# bitboards of boards as an (N, 8) uint64 array: the pawns, knights, bishops,
+# rooks, queens and kings of both colors, then the white and black pieces
+def pack(boards):
+    return np.array([[board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+                      board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]] for board in boards],
+                    dtype=U64).reshape(-1, 8)
+
+
+# (N, 12, 64) array of 0/1, the pieces of each color and piece type by square
+def planes(bitboards):
+    pieces = np.empty((len(bitboards), NUM_PLANES), dtype=U64)
+    for color in PLANE_COLORS:
+        column = WHITE if color else BLACK
+        for piece_type in chess.PIECE_TYPES:
+            pieces[:, plane(color, piece_type)] = bitboards[:, piece_type - 1] & bitboards[:, column]
+    return ((pieces[:, :, None] >> BITS) & U64(1)).astype(np.uint8)
+
+
+def popcount(x):
+    x = x - ((x >> U64(1)) & M1)
+    x = (x & M2) + ((x >> U64(2)) & M2)
+    x = (x + (x >> U64(4))) & M4
+    return ((x * H01) >> U64(56)).astype(np.int64)
+
+
+def shift(bitboards, step):
+    amount, mask = step
+    if amount > 0:
+        return (bitboards & mask) << U64(amount)
+    return (bitboards & mask) >> U64(-amount)
+
+
+# squares attacked from each direction of steps by sliders, stopping at the
+# first occupied square: one attack set per direction
+def slider_attacks(sliders, empty, steps):
+    attacks = []
+    for step in steps:
+        fill = sliders
+        for _ in range(6):
+            fill = fill | (shift(fill, step) & empty)
+        attacks.append(shift(fill, step))
+    return attacks
+
+
+# attack counts of one color as evaluator.attack_counts: bit-sliced counters
+# over every square, for all positions at once
+def attack_counts(bitboards, color):
+    own = bitboards[:, WHITE if color else BLACK]
+    empty = ~(bitboards[:, WHITE] | bitboards[:, BLACK])
+    pawns = bitboards[:, PAWNS] & own
+    queens = bitboards[:, QUEENS] & own
+    if color:
+        attacks = [shift(pawns, (7, NOT_FILE_A)), shift(pawns, (9, NOT_FILE_H))]
+    else:
+        attacks = [shift(pawns, (-9, NOT_FILE_A)), shift(pawns, (-7, NOT_FILE_H))]
+    knights = bitboards[:, KNIGHTS] & own
+    attacks += [shift(knights, step) for step in KNIGHT_STEPS]
+    kings = bitboards[:, KINGS] & own
+    attacks += [shift(kings, step) for step in ROOK_STEPS + BISHOP_STEPS]
+    attacks += slider_attacks((bitboards[:, ROOKS] & own) | queens, empty, ROOK_STEPS)
+    attacks += slider_attacks((bitboards[:, BISHOPS] & own) | queens, empty, BISHOP_STEPS)
+
+    counts = [np.zeros(len(bitboards), dtype=U64) for _ in range(evaluator.ATTACK_COUNT_BITS)]
+    for carry in attacks:
+        for i in range(evaluator.ATTACK_COUNT_BITS):
+            counts[i], carry = counts[i] ^ carry, counts[i] & carry
+    return counts
+
+
+def outnumbers(counts, other_counts):
+    greater = np.zeros(len(counts[0]), dtype=U64)
+    equal = np.full(len(counts[0]), ALL, dtype=U64)
+    for i in range(evaluator.ATTACK_COUNT_BITS - 1, -1, -1):
+        greater |= equal & counts[i] & ~other_counts[i]
+        equal &= ~(counts[i] ^ other_counts[i])
+    return greater
+
+
+# Evaluator.pawn_structure of one color from its pawns: a pawn is isolated
+# when no pawn on an earlier square shares a neighbouring column with it
+def pawn_structure(pawns):
+    distinct = 0
+    # squares before the first pawn of each column (all of them for none)
+    before = []
+    for mask in COLUMN_MASKS:
+        column = pawns & mask
+        distinct = distinct + (column != 0)
+        before.append((column & (~column + U64(1))) - U64(1))
+    isolated = np.zeros(len(pawns), dtype=U64)
+    for column, mask in enumerate(COLUMN_MASKS):
+        isolated |= mask & before[(column - 1) % 7] & before[(column + 1) % 7]
+    count = popcount(pawns)
+    doubled = count - distinct
+    rams = popcount(pawns & (pawns << U64(8)))
+    return distinct - doubled - rams - popcount(pawns & isolated) - (count > 7)
+
+
+# Evaluator's king safety of one color: the tropism terms are added up square
+# by square in the evaluator's order, so that the floats round the same way
+def king_safety(bitboards, piece_planes, pawns, color):
+    own = bitboards[:, WHITE if color else BLACK]
+    king_plane = piece_planes[:, plane(color, chess.KING)]
+    # the last king square, or 0 without a king
+    king = np.where(king_plane.any(axis=1), 63 - np.argmax(king_plane[:, ::-1], axis=1), 0)
+    # by square, then position
+    distances = TROPISM_BY_SQUARE[:, king]
+    tropism = np.zeros(len(bitboards))
+    for piece_type in [chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN]:
+        terms = distances * TROPISM_WEIGHTS[piece_type]
+        pieces = ((bitboards[:, piece_type - 1] & own) >> BITS[:, None]) & U64(1) != 0
+        for square in np.flatnonzero(pieces.any(axis=1)):
+            np.subtract(tropism, terms[square], out=tropism, where=pieces[square])
+    shield = (3 * popcount(pawns & SHIELD_MASKS[0][king]) + 2 * popcount(pawns & SHIELD_MASKS[1][king])
+              + popcount(pawns & SHIELD_MASKS[2][king]))
+    return tropism * 0.3 + shield * 1.0
+
+
+# the game phase of each position and an (N, 6) array of its features, in the
+# order of evaluator.FEATURE_NAMES (king safety and pawn advantage are only
+# used by the phases that weight them)
+def features(bitboards):
+    bitboards = np.asarray(bitboards, dtype=U64).reshape(-1, 8)
+    n = len(bitboards)
+    occupied = bitboards[:, WHITE] | bitboards[:, BLACK]
+    majors = popcount(occupied & ~bitboards[:, PAWNS])
+    phase = np.where(majors > 12, OPENING, np.where(majors > 7, MIDDLEGAME, ENDGAME))
+
+    piece_planes = planes(bitboards)
+    counts = piece_planes.sum(axis=2).astype(np.int64)
+    material = counts.dot(SIGNED_MATERIAL)
+    for color in chess.COLORS:
+        sign = 1 if color else -1
+        material += 2 * sign * (counts[:, plane(color, chess.BISHOP)] == 2)
+        material -= sign * (counts[:, plane(color, chess.KNIGHT)] == 2)
+    positional = piece_planes.reshape(n, -1).astype(np.int64).dot(SIGNED_PST.reshape(-1))
+
+    white_counts = attack_counts(bitboards, chess.WHITE)
+    black_counts = attack_counts(bitboards, chess.BLACK)
+    mobility = popcount(outnumbers(white_counts, black_counts)) - popcount(outnumbers(black_counts, white_counts))
+
+    pawns = [bitboards[:, PAWNS] & bitboards[:, BLACK], bitboards[:, PAWNS] & bitboards[:, WHITE]]
+    structure = pawn_structure(pawns[chess.WHITE]) - pawn_structure(pawns[chess.BLACK])
+    safety = king_safety(bitboards, piece_planes, pawns[chess.WHITE], chess.WHITE) \
+        - king_safety(bitboards, piece_planes, pawns[chess.BLACK], chess.BLACK)
+    p = counts[:, plane(chess.WHITE, chess.PAWN)] - counts[:, plane(chess.BLACK, chess.PAWN)]
+    advantage = 1.0 / (1.0 + (10.0 ** (-p / 4.0)))
+
+    values = np.column_stack([material.astype(float), positional, mobility, structure.astype(float),
+                              safety, advantage])
+    return phase, values
+
+
+# static scores of the packed positions, as Evaluator.evaluate(board,
+# check_terminal=False) gives them
+def evaluate_bitboards(bitboards, centipawns=False):
+    phase, values = features(bitboards)
+    scores = np.zeros(len(values))
+    for p, weights in enumerate(PHASE_WEIGHTS):
+        score = np.zeros(len(values))
+        for i, weight in enumerate(weights):
+            score = score + values[:, i] * weight
+        scores = np.where(phase == p, score, scores)
+    if centipawns:
+        scores = to_centipawns(scores)
+    return scores
+
+
+# rounds scores in pawns to centipawns half away from zero, as Python 2's
+# round does, keeping infinite scores as +-MATE_SCORE
+def to_centipawns(scores):
+    scaled = np.abs(scores * CENTIPAWNS_PER_PAWN)
+    finite = np.isfinite(scaled)
+    scaled[~finite] = 0
+    rounded = np.floor(scaled)
+    rounded += (scaled - rounded) >= 0.5
+    result = (np.sign(scores) * rounded).astype(np.int64)
+    result[~finite] = np.sign(scores[~finite]).astype(np.int64) * MATE_SCORE
+    return result
+
+
+# scores of a sequence of boards, equal to Evaluator(centipawns=centipawns)
+# .evaluate(board, check_terminal) for each; the test for the end of the game
+# is made board by board
+def evaluate_batch(boards, check_terminal=True, centipawns=False):
+    boards = list(boards)
+    scores = evaluate_bitboards(pack(boards))
+    if check_terminal:
+        for i, board in enumerate(boards):
+            if board.is_game_over():
+                result = board.result()
+                if result == "0-1":
+                    scores[i] = evaluator.black_win_value
+                elif result == "1-0":
+                    scores[i] = evaluator.white_win_value
+                else:
+                    scores[i] = 0.0
+    if centipawns:
+        scores = to_centipawns(scores)
+    return scores
@@ -0,0 +1,196 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# bench.py
+# This file has the benchmarks we use to measure the speed of our search
+# agents, e.g. python bench.py smp
+
+import sys
+import random
+import multiprocessing
+from timeit import default_timer as timer
+
+import chess
+import main
+import stacksearch
+import searchboard
+import evaluator
+
+# positions used by the benchmarks: the tactics from tests.py
+BENCH_FENS = ["1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1",
+              "r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15",
+              "rn1q1rk1/ppp1b1pp/3pP3/3p4/3P1B2/5NP1/PPP4P/R2Q1K1R b - - 0 13",
+              "5k2/6pp/R2P1p2/4p3/pr2P3/5PKP/8/8 w - - 9 37"]
+
+
+# Lazy SMP: time to reach a fixed depth against the number of worker processes
+def bench_smp(depth=6, max_workers=None):
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+
+    print "Lazy SMP time-to-depth, depth", depth, "on", multiprocessing.cpu_count(), "cores"
+    print "workers   seconds   speedup"
+    base = None
+    for workers in counts:
+        seconds = 0.0
+        for fen in BENCH_FENS:
+            agent = main.DeepCrimsonAgent(chess.Board(fen), max_depth=depth,
+                                          evaluation_type=main.EvalType.SIMPLE, workers=workers)
+            start = timer()
+            agent.parallel_search()
+            seconds += timer() - start
+        if base is None:
+            base = seconds
+        print "%7d %9.2f %9.2fx" % (workers, seconds, base / seconds)
+
+
+# recursive against explicit-stack MTD(f): same nodes, compares nodes per second
+def bench_stack(depth=4):
+    print "Recursive vs explicit-stack MTD(f), depth", depth
+    print "search           nodes   seconds      kn/s"
+    for name in ['recursive', 'explicit-stack']:
+        nodes = 0
+        seconds = 0.0
+        for fen in BENCH_FENS:
+            agent = main.DeepCrimsonAgent(chess.Board(fen), max_depth=depth, evaluation_type=main.EvalType.SIMPLE)
+            start = timer()
+            if name == 'recursive':
+                agent.mtdf_search()
+            else:
+                search = stacksearch.ResumableSearch(agent)
+                search.start_mtdf()
+                search.run()
+            seconds += timer() - start
+            nodes += agent.nodes + agent.qnodes
+        print "%-14s %7d %9.2f %9.2f" % (name, nodes, seconds, nodes / 1000.0 / seconds)
+
+
+# Multi-PV: cost of the extra lines compared to a single-line search
+def bench_multipv(depth=4, max_lines=4):
+    print "Multi-PV cost, depth", depth
+    print "lines     nodes   seconds   vs 1 line   nodes per line"
+    base = None
+    for k in range(1, max_lines + 1):
+        nodes = 0
+        seconds = 0.0
+        per_line = [0] * k
+        for fen in BENCH_FENS:
+            agent = main.DeepCrimsonAgent(chess.Board(fen), max_depth=depth, evaluation_type=main.EvalType.SIMPLE)
+            start = timer()
+            agent.multipv_search(k)
+            seconds += timer() - start
+            nodes += agent.nodes + agent.qnodes
+            for i, line in enumerate(agent.line_nodes):
+                per_line[i] += line
+        if base is None:
+            base = seconds
+        print "%5d %9d %9.2f %10.2fx   %s" % (k, nodes, seconds, seconds / base, " ".join(str(n) for n in per_line))
+
+
+# MTD(f) passes per depth on float pawn scores against integer centipawns; the
+# float search is shown with its old one pawn step and with a centipawn step
+def bench_mtdf(depth=2):
+    print "MTD(f) passes per depth, depth", depth
+    print "scores                    passes    nodes   seconds"
+    modes = [('float, step 1', False, 1), ('float, step 0.01', False, 0.01),
+             ('centipawns, step 1', True, 1), ('centipawns, step 10', True, 10)]
+    for name, centipawns, granularity in modes:
+        passes = [0] * depth
+        nodes = 0
+        seconds = 0.0
+        for fen in BENCH_FENS:
+            agent = main.DeepCrimsonAgent(chess.Board(fen), max_depth=depth, centipawns=centipawns,
+                                          mtdf_granularity=granularity)
+            start = timer()
+            agent.mtdf_search()
+            seconds += timer() - start
+            nodes += agent.time_manager.base_nodes + agent.nodes + agent.qnodes
+            for i, count in enumerate(agent.mtdf_passes):
+                passes[i] += count
+        print "%-20s %11s %8d %9.2f" % (name, "/".join(str(count) for count in passes), nodes, seconds)
+
+
+# SearchBoard against chess.Board: perft to a fixed depth, and the search's
+# nodes per second with and without fast_board
+def bench_board(perft_depth=3, depth=5):
+    print "Perft, depth", perft_depth
+    print "board              nodes   seconds      kn/s"
+    for name in ['chess.Board', 'SearchBoard']:
+        nodes = 0
+        seconds = 0.0
+        for fen in BENCH_FENS:
+            board = chess.Board(fen)
+            if name == 'SearchBoard':
+                board = searchboard.SearchBoard.from_board(board)
+            start = timer()
+            nodes += searchboard.perft(board, perft_depth)
+            seconds += timer() - start
+        print "%-14s %9d %9.2f %9.2f" % (name, nodes, seconds, nodes / 1000.0 / seconds)
+
+    print "MTD(f) search, depth", depth
+    print "board              nodes   seconds      kn/s"
+    for fast_board in [False, True]:
+        nodes = 0
+        seconds = 0.0
+        for fen in BENCH_FENS:
+            agent = main.DeepCrimsonAgent(chess.Board(fen), max_depth=depth, evaluation_type=main.EvalType.SIMPLE,
+                                          fast_board=fast_board)
+            start = timer()
+            agent.mtdf_search()
+            seconds += timer() - start
+            nodes += agent.time_manager.base_nodes + agent.nodes + agent.qnodes
+        print "%-14s %9d %9.2f %9.2f" % ('SearchBoard' if fast_board else 'chess.Board', nodes, seconds,
+                                          nodes / 1000.0 / seconds)
+
+
+# NumPy batch evaluation against one Evaluator.evaluate call per position:
+# positions per second on the positions of random games from BENCH_FENS
+def bench_batch(games=50, plies=100):
+    import batch
+
+    rng = random.Random(182)
+    boards = []
+    for fen in BENCH_FENS:
+        for _ in range(games):
+            board = chess.Board(fen)
+            for _ in range(plies):
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+                boards.append(board.copy(stack=False))
+
+    print "Static evaluation of", len(boards), "positions"
+    print "evaluation          seconds    positions/s"
+    e = evaluator.Evaluator(cache=evaluator.EvalCache(0))
+    start = timer()
+    expected = [e.evaluate(board, check_terminal=False) for board in boards]
+    seconds = timer() - start
+    print "%-16s %10.2f %14.0f" % ('scalar', seconds, len(boards) / seconds)
+
+    start = timer()
+    bitboards = batch.pack(boards)
+    packing = timer() - start
+    scores = batch.evaluate_bitboards(bitboards)
+    seconds = timer() - start
+    print "%-16s %10.2f %14.0f   (%.2f s packing)" % ('batch', seconds, len(boards) / seconds, packing)
+    print "identical scores:", list(scores) == expected
+
+
+BENCHMARKS = {
+    'batch': bench_batch,
+    'board': bench_board,
+    'mtdf': bench_mtdf,
+    'multipv': bench_multipv,
+    'smp': bench_smp,
+    'stack': bench_stack,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+        print
@@ -5,10 +5,17 @@
 import chess
 import chess.polyglot
 import chess.syzygy
+from chess import popcount, scan_forward
+from transposition import EvalCache, PawnHashTable, EVAL_CACHE_BYTES, PAWN_TABLE_SIZE
+from searchboard import SearchBoard, pawn_zobrist_hash, piece_count
 
 white_win_value = float("inf")
 black_win_value = float("-inf")
 
+# in centipawn mode evaluations are integers and a won game is worth MATE_SCORE
+CENTIPAWNS_PER_PAWN = 100
+MATE_SCORE = 1000000
+
 '''
 Below are piece-square tables used in our positional feature to
 give the approximate value of that specific piece in a position.
@@ -76,10 +83,133 @@ king_table_end = [-50,-40,-30,-20,-20,-30,-40,-50,
                 -30,-30,  0,  0,  0,  0,-30,-30,
                 -50,-30,-30,-30,-30,-30,-30,-50 ]
 
+'''
+Below are the tables used by Evaluator.features, precomputed so that a leaf
+evaluation only walks the board's bitboards.
+'''
+# game phases, chosen by the number of pieces other than pawns
+OPENING = 0
+MIDDLEGAME = 1
+ENDGAME = 2
+PHASE_NAMES = ["OPENING", "MIDDLEGAME", "ENDGAME"]
+
+# feature weights of each phase, for the features in the order of FEATURE_NAMES
+PHASE_WEIGHTS = [[1.5, 0.001, 0.0005, 0.03],
+                 [1.5, 0.002, 0.0005, 0.05, 0.04],
+                 [1.5, 0.001, 0.0001, 0.06, 0.07, 0.1]]
+FEATURE_NAMES = ["material score", "positional score", "mobility score", "pawn structure score",
+                 "king safety score", "pawn advantage score"]
+
+# square seen from the black side of the board
+FLIPPED = [(7 - (square % 8)) + ((7 - (square // 8)) * 8) for square in chess.SQUARES]
+
+# piece-square tables by color and piece type, already flipped for black
+PIECE_TABLES = [None, pawn_table, knight_table, bishop_table, rook_table, queen_table, king_table_open]
+PST = [[None] + [[table[FLIPPED[square]] for square in chess.SQUARES] for table in PIECE_TABLES[1:]],
+       [None] + [[table[square] for square in chess.SQUARES] for table in PIECE_TABLES[1:]]]
+
+# Shannon's material values by piece type
+MATERIAL_VALUES = [0, 1, 3, 3, 5, 9, 0]
+
+# king tropism: the (inverse) distance term by king square and piece square,
+# and the weight of each piece type
+TROPISM = [[14 - abs(square % 8 - king % 8) + abs(square // 8 - king // 8) for square in chess.SQUARES]
+           for king in chess.SQUARES]
+TROPISM_WEIGHTS = [0, 0.1, 0.5, 1.0, 0.5, 2.0, 0]
+
+
+def square_mask(king, offsets):
+    mask = 0
+    for offset in offsets:
+        if 0 <= king + offset < 64:
+            mask |= chess.BB_SQUARES[king + offset]
+    return mask
+
+# pawn shield squares in front of, beside and behind each king square
+SHIELD_FRONT = [square_mask(king, [-9, -8, -7]) for king in chess.SQUARES]
+SHIELD_SIDE = [square_mask(king, [-1, 1]) for king in chess.SQUARES]
+SHIELD_BEHIND = [square_mask(king, [7, 8, 9]) for king in chess.SQUARES]
+
+# pawn structure works on columns numbered square % 7: the bit of a square's
+# column, and the bits of the columns ps_eval treats as its neighbours
+COLUMN_BITS = [1 << (square % 7) for square in chess.SQUARES]
+NEIGHBOUR_BITS = [(1 << ((square - 1) % 7)) | (1 << ((square + 1) % 7)) for square in chess.SQUARES]
+
+# bits of the per-square attacker counts of mob_eval
+ATTACK_COUNT_BITS = 5
+
+
+# attackers of color on every square, counted the way board.attackers does,
+# as bit-sliced counters: bit i of a square's count is set in counts[i]. No
+# square has more than 16 attackers of one color (8 rays and 8 knight jumps).
+def attack_counts(board, color):
+    counts = [0] * ATTACK_COUNT_BITS
+    own = board.occupied_co[color]
+    occupied = board.occupied
+
+    # every pawn attacks at most one square to each side
+    pawns = board.pawns & own
+    if color == chess.WHITE:
+        attacks = [((pawns & ~chess.BB_FILE_A) << 7) & chess.BB_ALL, ((pawns & ~chess.BB_FILE_H) << 9) & chess.BB_ALL]
+    else:
+        attacks = [(pawns & ~chess.BB_FILE_A) >> 9, (pawns & ~chess.BB_FILE_H) >> 7]
+
+    for square in scan_forward(board.knights & own):
+        attacks.append(chess.BB_KNIGHT_ATTACKS[square])
+    for square in scan_forward(board.kings & own):
+        attacks.append(chess.BB_KING_ATTACKS[square])
+    queens = board.queens & own
+    for square in scan_forward((board.bishops & own) | queens):
+        attacks.append(chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied])
+    for square in scan_forward((board.rooks & own) | queens):
+        attacks.append(chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] |
+                       chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied])
+
+    # add each attack set to the counters, rippling the carries upwards
+    for carry in attacks:
+        i = 0
+        while carry:
+            counts[i], carry = counts[i] ^ carry, counts[i] & carry
+            i += 1
+    return counts
+
+
+# squares whose count in counts is greater than in other_counts
+def outnumbers(counts, other_counts):
+    greater = 0
+    equal = chess.BB_ALL
+    for i in range(ATTACK_COUNT_BITS - 1, -1, -1):
+        greater |= equal & counts[i] & ~other_counts[i]
+        equal &= ~(counts[i] ^ other_counts[i])
+    return greater
+
+
+# the evaluation cache of every Evaluator in this process (a forked worker
+# gets its own copy), made on first use; asking for another byte budget
+# replaces it by an empty cache of that size for the evaluators made after
+_eval_cache = None
+
+
+def shared_eval_cache(max_bytes=None):
+    global _eval_cache
+    if _eval_cache is None or (max_bytes is not None and max_bytes != _eval_cache.max_bytes):
+        _eval_cache = EvalCache(EVAL_CACHE_BYTES if max_bytes is None else max_bytes)
+    return _eval_cache
+
+
 class Evaluator():
-    def __init__(self, verbose=False):
-        self._pos_dict = {}
+    def __init__(self, verbose=False, centipawns=False, cache=None, pawn_table_size=PAWN_TABLE_SIZE):
+        # evaluations are cached in pawns, so evaluators of either unit share
+        # the process-wide cache unless given their own
+        self.cache = cache if cache is not None else shared_eval_cache()
+        # pawn structure and pawn shield terms by pawn-only zobrist key
+        self.pawn_table = PawnHashTable(pawn_table_size)
         self.verbose = verbose
+        # return integer centipawns and finite mate scores instead of float pawns and infinities
+        self.centipawns = centipawns
+        # evaluations requested, and those answered from the cache
+        self.calls = 0
+        self.cache_hits = 0
 
     # board positional evaluation feature
     def pos_eval(self, board, color, endgame):
@@ -140,19 +270,18 @@ class Evaluator():
         return score
 
     # Returns balance of controlled squares on board
+    # (squares where color has more attackers than the other side)
     def num_controlled_squares(self, board, color):
-        controlled_squares = 0
-        for square in chess.SQUARES:
-            if len(board.attackers(color, square)) > len(board.attackers(not color, square)):
-                controlled_squares += 1
-        return controlled_squares
+        return popcount(outnumbers(attack_counts(board, color), attack_counts(board, not color)))
 
     def naive_mob_score(self, board):
         return len(list(board.legal_moves))
 
     # Mobility evaluation featuring using controlled squares
     def mob_eval(self, board, color):
-        return self.num_controlled_squares(board, color) - self.num_controlled_squares(board, not color)
+        own = attack_counts(board, color)
+        other = attack_counts(board, not color)
+        return popcount(outnumbers(own, other)) - popcount(outnumbers(other, own))
 
     # Pawn structure evaluation featuring using a variety of metrics
     def ps_eval(self, board, color):
@@ -345,36 +474,182 @@ class Evaluator():
 
         return score
 
-    # Evaluation called from agents
-    def evaluate(self, board):
-        # Checks if position has already been evaluated
-        if board.zobrist_hash() in self._pos_dict:
-            # Returns score from dictionary
-            return self._pos_dict.get(board.zobrist_hash)
+    # All features of the board's game phase in one pass over its bitboards,
+    # equal to those of the phase evals above; returns the phase and the values
+    # in the order of FEATURE_NAMES. A SearchBoard keeps the material and
+    # piece-square sums itself, updated move by move
+    def features(self, board):
+        pawns = board.pawns
+        majors = popcount(board.occupied & ~pawns)
+        if majors > 12:
+            phase = OPENING
+        elif majors > 7:
+            phase = MIDDLEGAME
+        else:
+            phase = ENDGAME
+
+        pieces = [(chess.PAWN, pawns), (chess.KNIGHT, board.knights), (chess.BISHOP, board.bishops),
+                  (chess.ROOK, board.rooks), (chess.QUEEN, board.queens), (chess.KING, board.kings)]
+        safety = [0, 0]
+
+        # the pawn structure terms depend on the pawns alone
+        pawn_table = self.pawn_table
+        pawn_key = board.pawn_zobrist_hash() if isinstance(board, SearchBoard) else pawn_zobrist_hash(board)
+        slot = pawn_table.probe(pawn_key)
+        if slot is None:
+            slot = pawn_table.store(pawn_key, self.pawn_structure(board, chess.WHITE)
+                                    - self.pawn_structure(board, chess.BLACK))
+
+        if isinstance(board, SearchBoard):
+            if board.psq_tables is not PST:
+                board.track_eval(PST, MATERIAL_VALUES)
+            material, positional, counts = board.eval_terms()
+            for color in chess.COLORS:
+                sign = 1 if color else -1
+                if piece_count(counts, color, chess.BISHOP) == 2:
+                    material += 2 * sign
+                if piece_count(counts, color, chess.KNIGHT) == 2:
+                    material -= sign
+        else:
+            material, positional = self.material_and_positional(board, pieces)
+
+        # king safety: tropism walks the pieces, the pawn shield is cached
+        if phase != OPENING:
+            for color in chess.COLORS:
+                own = board.occupied_co[color]
+                king = 0
+                for square in scan_forward(board.kings & own):
+                    king = square
+                distances = TROPISM[king]
+                tropism_score = 0
+                for piece_type, mask in pieces[:5]:
+                    weight = TROPISM_WEIGHTS[piece_type]
+                    for square in scan_forward(mask & own):
+                        tropism_score -= distances[square] * weight
+                pawn_shield = pawn_table.shield(slot, color, king)
+                if pawn_shield is None:
+                    own_pawns = pawns & own
+                    pawn_shield = (3 * popcount(own_pawns & SHIELD_FRONT[king])
+                                   + 2 * popcount(own_pawns & SHIELD_SIDE[king])
+                                   + popcount(own_pawns & SHIELD_BEHIND[king]))
+                    pawn_table.store_shield(slot, color, king, pawn_shield)
+                safety[color] = tropism_score * 0.3 + pawn_shield * 1.0
+
+        values = [float(material),
+                  positional,
+                  self.mob_eval(board, chess.WHITE),
+                  float(pawn_table.structure[slot])]
+        if phase != OPENING:
+            values.append(safety[chess.WHITE] - safety[chess.BLACK])
+        if phase == ENDGAME:
+            p = popcount(pawns & board.occupied_co[chess.WHITE]) - popcount(pawns & board.occupied_co[chess.BLACK])
+            values.append(1.0 / (1.0 + (10.0 ** (-p / 4.0))))
+        return phase, values
+
+    # white minus black material (with the pair terms) and piece-square sums
+    # from scratch; pieces lists (piece type, bitboard) in order
+    def material_and_positional(self, board, pieces):
+        material = 0
+        positional = 0
+        for color in chess.COLORS:
+            own = board.occupied_co[color]
+            sign = 1 if color else -1
+            tables = PST[color]
+            for piece_type, mask in pieces:
+                table = tables[piece_type]
+                count = 0
+                for square in scan_forward(mask & own):
+                    positional += sign * table[square]
+                    count += 1
+                material += sign * MATERIAL_VALUES[piece_type] * count
+                if piece_type == chess.BISHOP and count == 2:
+                    material += 2 * sign
+                elif piece_type == chess.KNIGHT and count == 2:
+                    material -= sign
+        return material, positional
+
+    # ps_eval of color as an integer, from the pawn bitboard: passed pawns
+    # are the first pawn of their column
+    def pawn_structure(self, board, color):
+        pawns = board.pawns & board.occupied_co[color]
+        columns = 0
+        doubled = 0
+        isolated = 0
+        for square in scan_forward(pawns):
+            if not columns & NEIGHBOUR_BITS[square]:
+                isolated += 1
+            if columns & COLUMN_BITS[square]:
+                doubled += 1
+            else:
+                columns |= COLUMN_BITS[square]
+        count = popcount(pawns)
+        rams = popcount(pawns & (pawns << 8))
+        return (count - doubled) - doubled - rams - isolated - (1 if count > 7 else 0)
+
+    # Evaluation called from agents; a search that detects mates and draws
+    # itself passes check_terminal=False to skip the costly game over test
+    def evaluate(self, board, check_terminal=True):
+        self.calls += 1
+        # The seventy-five move rule and fivefold repetition depend on the
+        # move history, which the key does not encode, so these draws are
+        # never cached; both need sixteen reversible plies at least
+        if check_terminal and board.halfmove_clock >= 16 and (
+                board.is_seventyfive_moves() or board.is_fivefold_repetition()):
+            return self.units(0.0)
+
+        # Checks if position has already been evaluated, by any evaluator
+        key = board.zobrist_hash()
+        score = self.cache.probe(key, check_terminal)
+        if score is not None:
+            self.cache_hits += 1
+            return self.units(score)
 
         # Checks for game over conditions
-        if board.is_game_over():
+        if check_terminal and board.is_game_over():
             if board.result() == "0-1":
-                return black_win_value
-            if board.result() == "1-0":
-                return white_win_value
+                score = black_win_value
+            elif board.result() == "1-0":
+                score = white_win_value
             else:
-                return 0
+                score = 0.0
+            self.cache.store(key, score, check_terminal)
+            return self.units(score)
 
-        # Depending on game phase, evaluates the board differently
-        if self.num_major_pieces(board) > 12:
-            score = self.openinggame_eval(board)
-        elif self.num_major_pieces(board) > 7:
-            score = self.middlegame_eval(board)
-        else:
-            score = self.endgame_eval(board)
+        # Depending on game phase, weights the features differently
+        phase, values = self.features(board)
+        if self.verbose:
+            print PHASE_NAMES[phase]
+            for name, value in zip(FEATURE_NAMES, values):
+                print name + " : " + str(value)
 
-        # Adds position score to dictionary
-        self._pos_dict[board.zobrist_hash] = score
-        return score
+        # Sets score as linear combination of features and their weights
+        score = 0
+        for value, weight in zip(values, PHASE_WEIGHTS[phase]):
+            score += value * weight
+
+        # Adds position score to the cache, in pawns
+        self.cache.store(key, score, check_terminal)
+        return self.units(score)
+
+    # a score in pawns (infinite for a won game) in this evaluator's units
+    def units(self, score):
+        if not self.centipawns:
+            return score
+        if score == white_win_value:
+            return MATE_SCORE
+        if score == black_win_value:
+            return -MATE_SCORE
+        return int(round(score * CENTIPAWNS_PER_PAWN))
 
 # used to help test search agents
 class SimpleEvaluator():
+    def __init__(self, centipawns=False):
+        # return integer centipawns and finite mate scores instead of float pawns and infinities
+        self.centipawns = centipawns
+        # evaluations requested; there is no cache to hit
+        self.calls = 0
+        self.cache_hits = 0
+
     def material(self, board, color):
         return len(board.pieces(chess.PAWN, color)) \
                + (3.0 * len(board.pieces(chess.KNIGHT, color))) \
@@ -382,15 +657,19 @@ class SimpleEvaluator():
                + (5.0 * len(board.pieces(chess.ROOK, color))) \
                + (9.0 * len(board.pieces(chess.QUEEN, color)))
 
-    def evaluate(self, board):
-        if board.is_game_over():
+    def evaluate(self, board, check_terminal=True):
+        self.calls += 1
+        if check_terminal and board.is_game_over():
             if board.result() == "0-1":
-                return black_win_value
+                return -MATE_SCORE if self.centipawns else black_win_value
             if board.result() == "1-0":
-                return white_win_value
+                return MATE_SCORE if self.centipawns else white_win_value
             else:
                 return 0
-        return self.material(board, chess.WHITE) - self.material(board, chess.BLACK)
+        score = self.material(board, chess.WHITE) - self.material(board, chess.BLACK)
+        if self.centipawns:
+            return int(score) * CENTIPAWNS_PER_PAWN
+        return score
 
 if __name__ == '__main__':
     e = Evaluator(verbose=True)
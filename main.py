@@ -1,6 +1,14 @@
+import multiprocessing
+import chess
 import chess.polyglot
 from timeit import default_timer as timer
-from evaluator import Evaluator, SimpleEvaluator
+from evaluator import Evaluator, SimpleEvaluator, CENTIPAWNS_PER_PAWN, MATE_SCORE
+from transposition import TranspositionTable, SharedTranspositionTable, PersistentTranspositionTable, EVAL_SIZE
+from ordering import MoveOrderer, MAX_PLY
+from see import is_losing
+from timemanager import TimeManager, SearchTimeout
+from searchboard import SearchBoard
+from stats import SearchStats
 
 
 class NodeType:
@@ -9,34 +17,73 @@ class NodeType:
     BETA = 3    # nodes with a value higher than the upper-bound beta
 
 
-class EvalType:
-    SIMPLE = 1   # nodes whose value was exactly calculated
-    COMPLEX = 2   # nodes with a value lower than the lower-bound alpha
+# width of the null windows used by principal variation search on float scores
+NULL_WINDOW = 1e-6
+
+# half-width of the first aspiration window around the previous iteration's score
+ASPIRATION_WINDOW = 0.5
+
+# null-move pruning: depth reduction and the shallowest depth it is tried at
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+
+# late move reductions: quiet moves after the first few are searched this much shallower
+LMR_REDUCTION = 1
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3
 
+# a mate found ply plies from the root is worth mate_score - ply, so scores
+# within MATE_PLIES of mate_score are mates, and shorter mates score higher
+MATE_PLIES = 1000
 
-class TableEntry:
-    def __init__(self, zobrist_key, best_move, depth, value, node_type):
-        self.zobrist_key = zobrist_key
+# default step of MTD(f)'s null-window searches, in centipawns: 0.01 on float
+# scores in pawns, 1 on integer centipawn scores
+MTDF_GRANULARITY = 1
+
+
+# result of an iterative-deepening search: the best move, its score from the
+# side to move's point of view, the principal variation and the depth reached
+class SearchResult():
+    def __init__(self, best_move, score, pv, depth):
         self.best_move = best_move
+        self.score = score
+        self.pv = pv
         self.depth = depth
-        self.value = value
-        self.node_type = node_type
+
+    def __repr__(self):
+        return "SearchResult(move=%s, score=%s, depth=%d, pv=%s)" % (
+            self.best_move, self.score, self.depth, " ".join(str(move) for move in self.pv))
+
+
+class EvalType:
+    SIMPLE = 1   # nodes whose value was exactly calculated
+    COMPLEX = 2   # nodes with a value lower than the lower-bound alpha
 
 
 # an iterative deepening minimax agent that can use alpha-beta and transposition tables to prune nodes
 class DeepCrimsonAgent():
-    def __init__(self, board, max_depth, evaluation_type, abpruning=True, transposition_table=True, table_size=2**20, verbose=False):
-        # initialize board
+    def __init__(self, board, max_depth=MAX_PLY, evaluation_type=EvalType.COMPLEX, abpruning=True, transposition_table=True, table_size=2**20, move_ordering=True, quiescence=True, qsearch_max_ply=None, max_time=None, max_nodes=None, pvs=True, aspiration=True, null_move=True, lmr=True, see=True, workers=1, fast_board=True, centipawns=False, mtdf_granularity=None, iteration_callback=None, verbose=False):
+        # initialize board; with fast_board the searches run on a SearchBoard copy
+        # of it, which makes and unmakes moves and updates its zobrist key cheaply
         self.board = board
+        self.fast_board = fast_board
 
-        # initialize max time allowed
+        # initialize max depth allowed
         self.max_depth = max_depth
 
-        # choose evaluation function
+        # initialize max time (seconds per move) and nodes allowed
+        self.time_manager = TimeManager(max_time=max_time, max_nodes=max_nodes)
+
+        # choose evaluation function, scoring in float pawns or integer centipawns;
+        # with centipawns a mate is worth MATE_SCORE (less its distance in plies)
+        # instead of infinity
+        self.centipawns = centipawns
         if evaluation_type == EvalType.SIMPLE:
-            self.evaluator = SimpleEvaluator()
+            self.evaluator = SimpleEvaluator(centipawns=centipawns)
         elif evaluation_type == EvalType.COMPLEX:
-            self.evaluator = Evaluator(verbose=False)
+            self.evaluator = Evaluator(verbose=False, centipawns=centipawns)
+        self.mate_score = MATE_SCORE if centipawns else float("inf")
+        self.mate_bound = self.mate_score - MATE_PLIES
 
         # choose whether or not to alpha-beta prune
         self.abpruning = abpruning
@@ -44,89 +91,549 @@ class DeepCrimsonAgent():
         # set up transposition table
         self.transposition_table = transposition_table
         self.TABLE_SIZE = table_size
-        if transposition_table:
-            self.tt = [None] * table_size
+        if transposition_table and workers > 1:
+            self.tt = SharedTranspositionTable(table_size)
+        elif transposition_table:
+            self.tt = TranspositionTable(table_size)
+
+        # persistent table and evaluation file, once attach_store is called
+        self.store = None
+
+        # number of processes used by parallel_search, and how many plies ahead
+        # of the main search this process runs (non-zero only in helpers)
+        self.workers = workers
+        self.depth_offset = 0
+
+        # set up move ordering (MVV-LVA, killer moves and history heuristic)
+        self.move_ordering = move_ordering
+        self.orderer = MoveOrderer(see=see)
+
+        # choose whether or not to resolve captures below the horizon, and how deep
+        self.quiescence = quiescence
+        self.qsearch_max_ply = qsearch_max_ply
+
+        # choose whether or not to order and prune captures by static exchange
+        # evaluation: losing captures are searched last, and not in quiescence
+        self.see = see
+
+        # choose whether or not to use null windows for non-PV moves and
+        # aspiration windows around the previous iteration's score
+        self.pvs = pvs
+        self.null_window = 1 if centipawns else NULL_WINDOW
+        self.aspiration = aspiration
+        self.aspiration_window = ASPIRATION_WINDOW * CENTIPAWNS_PER_PAWN if centipawns else ASPIRATION_WINDOW
+
+        # null-window step of MTD(f) in the evaluator's units (None for
+        # MTDF_GRANULARITY centipawns), and its number of passes at each completed depth
+        if mtdf_granularity is None:
+            mtdf_granularity = MTDF_GRANULARITY if centipawns else MTDF_GRANULARITY / float(CENTIPAWNS_PER_PAWN)
+        self.mtdf_granularity = mtdf_granularity
+        self.mtdf_passes = []
+
+        # choose whether or not to prune with null moves and reduce late quiet moves
+        self.null_move = null_move
+        self.null_move_reduction = NULL_MOVE_REDUCTION
+        self.lmr = lmr
+        self.lmr_reduction = LMR_REDUCTION
+
+        # triangular principal variation table: row ply holds the best line
+        # found from ply onwards, pv_length[ply] is where that row ends
+        self.pv_table = [[None] * (MAX_PLY + 2) for _ in range(MAX_PLY + 2)]
+        self.pv_length = [0] * (MAX_PLY + 2)
+        self.last_result = None
+
+        # zobrist keys of the game positions and search ancestors a position can
+        # repeat: every node with children pushes its key while they are searched
+        self.key_stack = []
+        # index in key_stack of the first position after the last null move on
+        # the current line: a pass is not a move, so nothing repeats across it
+        self.null_floor = 0
+
+        self.nodes = 0
+        self.qnodes = 0
+
+        # statistics of the last search, and an optional function called with
+        # them after every completed iteration
+        self.stats = SearchStats()
+        self.iteration_callback = iteration_callback
+        self.eval_calls_base = 0
+        self.eval_cache_hits_base = 0
 
         # print output if necessary
         self.verbose = verbose
 
-    # returns the negamax value of the current board state
-    def negamax_value(self, depth, alpha, beta, color):
-        if depth == 0 or self.board.is_game_over():
-            return color * self.evaluator.evaluate(self.board)
-
-        legal_moves = self.board.legal_moves
+    # returns the negamax value of the current board state; null_allowed is
+    # false right after a null move so two are never played in a row
+    def negamax_value(self, depth, alpha, beta, color, ply=0, null_allowed=True):
+        if self.nodes + self.qnodes >= self.time_manager.next_check:
+            self.time_manager.check(self.nodes + self.qnodes)
+        self.pv_length[ply] = ply
+
+        # a repetition needs at least four reversible plies, so the key is only
+        # computed this early when the halfmove clock allows one
+        key = None
+        if ply > 0:
+            if self.board.halfmove_clock >= 4:
+                key = self.board.zobrist_hash()
+            if self.is_draw(key):
+                return 0
+
+        if depth == 0 and self.quiescence:
+            return self.quiescence_value(alpha, beta, color, 0, ply)
+        if depth == 0:
+            return self.leaf_value(color, ply)
+
+        # pseudo-legal moves, whose legality is only tested once a move is played;
+        # in check python-chess's evasion generator is much faster
+        in_check = self.board.is_check()
+        legal_moves = self.board.legal_moves if in_check else self.board.pseudo_legal_moves
+        tt_move = None
+        if key is None:
+            key = self.board.zobrist_hash()
 
         # read from the transposition table
         if self.transposition_table:
-            key = self.board.zobrist_hash()
-            index = key % self.TABLE_SIZE
             old_alpha = alpha
 
-            table_entry = self.tt[index]
-            if table_entry is not None and table_entry.zobrist_key == key:
-                if table_entry.depth >= depth:
-                    if table_entry.node_type == NodeType.EXACT:
-                        return table_entry.value
-                    elif table_entry.node_type == NodeType.BETA:
-                        alpha = max(alpha, table_entry.value)
-                    elif table_entry.node_type == NodeType.ALPHA:
-                        beta = min(beta, table_entry.value)
+            self.stats.tt_probes += 1
+            table_entry = self.tt.probe(key)
+            if table_entry is not None:
+                self.stats.tt_hits += 1
+                tt_move, tt_depth, tt_value, tt_type = table_entry
+                tt_value = self.value_from_tt(tt_value, ply)
+                if tt_depth >= depth:
+                    if tt_type == NodeType.EXACT:
+                        self.stats.tt_cutoffs += 1
+                        return tt_value
+                    elif tt_type == NodeType.BETA:
+                        alpha = max(alpha, tt_value)
+                    elif tt_type == NodeType.ALPHA:
+                        beta = min(beta, tt_value)
                     if alpha >= beta:
-                        return table_entry.value
-                if table_entry.best_move in legal_moves:
+                        self.stats.tt_cutoffs += 1
+                        return tt_value
+                if not self.move_ordering and tt_move in legal_moves:
                     legal_moves = list(legal_moves)
-                    legal_moves.insert(0, legal_moves.pop(legal_moves.index(table_entry.best_move)))
+                    legal_moves.insert(0, legal_moves.pop(legal_moves.index(tt_move)))
+
+        self.key_stack.append(key)
+
+        # null move: if passing still fails high, a real move will too; skipped in
+        # check and when only pawns are left, where zugzwang makes passing unsound
+        if self.null_move and self.abpruning and null_allowed and depth >= NULL_MOVE_MIN_DEPTH \
+                and beta != float("+inf") and not in_check and self.has_non_pawn_material():
+            self.nodes += 1
+            null_floor = self.null_floor
+            self.null_floor = len(self.key_stack)
+            self.board.push(chess.Move.null())
+            v = -self.negamax_value(max(0, depth - 1 - self.null_move_reduction), -beta,
+                                    -beta + self.null_window, -color, ply + 1, False)
+            self.board.pop()
+            self.null_floor = null_floor
+            if v >= beta:
+                self.key_stack.pop()
+                # mate scores found after passing are not trustworthy
+                return beta if v >= self.mate_bound else v
+
+        if self.move_ordering:
+            legal_moves = self.ordered_moves(legal_moves, ply, tt_move)
 
         best_value = float("-inf")
         best_move = None
+        # i counts the legal moves searched so far
+        i = 0
         for move in legal_moves:
-            self.nodes += 1
+            late = self.lmr and self.abpruning and i >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH \
+                and not in_check and alpha != float("-inf") and not move.promotion \
+                and not self.board.is_capture(move) and not self.orderer.is_killer(move, ply)
             self.board.push(move)
-            v = -self.negamax_value(depth - 1, -beta, -alpha, -color)
+            if self.board.was_into_check():
+                self.board.pop()
+                continue
+            self.nodes += 1
+            if late and not self.board.is_check():
+                # reduced null-window search, verified at full depth if it beats alpha
+                v = -self.negamax_value(depth - 1 - self.lmr_reduction, -alpha - self.null_window, -alpha, -color, ply + 1)
+                if v > alpha:
+                    v = self.pvs_child_value(i, depth - 1, alpha, beta, color, ply + 1)
+            else:
+                v = self.pvs_child_value(i, depth - 1, alpha, beta, color, ply + 1)
             self.board.pop()
             if v > best_value:
                 best_value = v
                 best_move = move
+                self.update_pv(ply, move)
             if self.abpruning:
                 alpha = max(alpha, v)
                 if alpha >= beta:
+                    self.stats.beta_cutoffs += 1
+                    if i == 0:
+                        self.stats.first_move_cutoffs += 1
+                    if self.move_ordering:
+                        self.orderer.record_cutoff(self.board, move, depth, ply, i)
+                    i += 1
                     break
+            i += 1
+        self.key_stack.pop()
+
+        # no legal moves: checkmate or stalemate
+        if i == 0:
+            return self.mated_value(ply) if in_check else 0
 
         # write to the transposition table
         if self.transposition_table:
-            if best_move <= old_alpha:
+            if best_value <= old_alpha:
                 node_type = NodeType.ALPHA
             elif best_value >= beta:
                 node_type = NodeType.BETA
             else:
                 node_type = NodeType.EXACT
-            self.tt[index] = TableEntry(key, best_move, depth, best_value, node_type)
+            self.tt.store(key, best_move, depth, self.value_to_tt(best_value, ply), node_type)
+
+        return best_value
+
+    # whether the current position is drawn by the fifty-move rule, insufficient
+    # material or a repetition; key is None when a repetition is impossible
+    def is_draw(self, key):
+        board = self.board
+        if board.halfmove_clock >= 100 or board.is_insufficient_material():
+            return True
+        if key is not None:
+            # positions with the same side to move, back to the last irreversible
+            # move or null move (which leaves the halfmove clock running)
+            keys = self.key_stack
+            for i in range(len(keys) - 4, max(-1, len(keys) - 1 - board.halfmove_clock, self.null_floor - 1), -2):
+                if keys[i] == key:
+                    return True
+        return False
+
+    # static value of a leaf at ply; only a position in check can be mate, so
+    # only then does the evaluator test for the end of the game
+    def leaf_value(self, color, ply=0):
+        return self.mate_distance(color * self.static_value(self.board.is_check()), ply)
+
+    # value of the side to move being checkmated at ply
+    def mated_value(self, ply):
+        return -(self.mate_score - ply)
+
+    # an evaluation at ply, its mate scores counted from the root
+    def mate_distance(self, value, ply):
+        if value >= self.mate_score:
+            return self.mate_score - ply
+        if value <= -self.mate_score:
+            return self.mated_value(ply)
+        return value
+
+    # a value at ply as stored in the transposition table: mates counted from
+    # the position instead of the root, so they hold wherever it is reached
+    def value_to_tt(self, value, ply):
+        if value >= self.mate_bound:
+            return value + ply
+        if value <= -self.mate_bound:
+            return value - ply
+        return value
+
+    # a transposition table value as seen at ply, the inverse of value_to_tt
+    def value_from_tt(self, value, ply):
+        if value >= self.mate_bound:
+            return value - ply
+        if value <= -self.mate_bound:
+            return value + ply
+        return value
+
+    # evaluation of the board, served from the persistent store when one is
+    # attached; check_terminal is passed on to the evaluator
+    def static_value(self, check_terminal):
+        if self.store is None:
+            return self.evaluator.evaluate(self.board, check_terminal)
+        key = self.board.zobrist_hash()
+        value = self.store.probe_eval(key)
+        if value is None:
+            value = self.evaluator.evaluate(self.board, check_terminal)
+            self.store.store_eval(key, value)
+        else:
+            self.stats.eval_calls += 1
+            self.stats.eval_cache_hits += 1
+        return value
+
+    # starts the key stack with the game positions since the last capture or
+    # pawn move, the only earlier positions the search can repeat
+    def seed_key_stack(self):
+        board = self.board.copy()
+        keys = []
+        for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+            board.pop()
+            keys.append(board.zobrist_hash())
+        keys.reverse()
+        self.key_stack = keys
+        self.null_floor = 0
+
+    # yields the moves of a node best first; the hash move comes before the
+    # other moves are even generated, since it often causes a cutoff on its own
+    def ordered_moves(self, moves, ply, tt_move):
+        if tt_move is not None and tt_move in moves:
+            yield tt_move
+            for move in self.orderer.order(self.board, moves, ply):
+                if move != tt_move:
+                    yield move
+        else:
+            for move in self.orderer.order(self.board, moves, ply):
+                yield move
+
+    # makes move followed by the line found below it the principal variation at ply
+    def update_pv(self, ply, move):
+        row = self.pv_table[ply]
+        child_row = self.pv_table[ply + 1]
+        row[ply] = move
+        end = self.pv_length[ply + 1]
+        for i in range(ply + 1, end):
+            row[i] = child_row[i]
+        self.pv_length[ply] = max(end, ply + 1)
+
+    # whether the side to move has any piece besides pawns and its king
+    def has_non_pawn_material(self):
+        board = self.board
+        return bool(board.occupied_co[board.turn] & ~(board.pawns | board.kings))
+
+    # returns the value of the (already pushed) i-th child: the first child gets
+    # the full window, later ones a null window that is widened only on fail high
+    def pvs_child_value(self, i, depth, alpha, beta, color, ply):
+        if i == 0 or not self.pvs or not self.abpruning or alpha == float("-inf"):
+            return -self.negamax_value(depth, -beta, -alpha, -color, ply)
+        v = -self.negamax_value(depth, -alpha - self.null_window, -alpha, -color, ply)
+        if alpha < v < beta:
+            v = -self.negamax_value(depth, -beta, -alpha, -color, ply)
+        return v
+
+    # returns the value of the current board state once captures and promotions
+    # are resolved; ply is that of the negamax leaf quiescence started from
+    def quiescence_value(self, alpha, beta, color, qply, ply=0):
+        if self.nodes + self.qnodes >= self.time_manager.next_check:
+            self.time_manager.check(self.nodes + self.qnodes)
+
+        in_check = self.board.is_check()
+        capped = self.qsearch_max_ply is not None and qply >= self.qsearch_max_ply
+
+        # stand pat: the side to move may decline every capture
+        if in_check and not capped:
+            best_value = float("-inf")
+            moves = self.board.legal_moves
+        else:
+            best_value = self.mate_distance(color * self.static_value(in_check), ply + qply)
+            if best_value >= beta or capped:
+                return best_value
+            alpha = max(alpha, best_value)
+            moves = self.tactical_moves()
+
+        if self.move_ordering:
+            moves = self.orderer.order(self.board, moves, 0)
+
+        for move in moves:
+            self.board.push(move)
+            if self.board.was_into_check():
+                self.board.pop()
+                continue
+            self.qnodes += 1
+            v = -self.quiescence_value(-beta, -alpha, -color, qply + 1, ply)
+            self.board.pop()
+            if v > best_value:
+                best_value = v
+            if v > alpha:
+                alpha = v
+                if alpha >= beta:
+                    break
 
+        # checkmated: no evasion exists
+        if in_check and not capped and best_value == float("-inf"):
+            return self.mated_value(ply + qply)
         return best_value
 
-    # returns the move associated with the highest negamax value
-    def negamax_search(self):
+    # pseudo-legal captures (en passant included) and promotions, the moves
+    # searched by quiescence when not in check, without the losing ones
+    def tactical_moves(self):
+        board = self.board
+        moves = list(board.generate_pseudo_legal_captures())
+        moves.extend(board.generate_pseudo_legal_moves(board.pawns, chess.BB_BACKRANKS & ~board.occupied))
+        if self.see:
+            moves = [move for move in moves if not is_losing(board, move)]
+        return moves
+
+    # switches to a transposition table and evaluation cache kept in the file
+    # at path, created if needed, so later agents start from what this one
+    # searched; flush_store writes it back. The file is tagged with the
+    # evaluator and score units and wiped if it was written with others
+    def attach_store(self, path, eval_size=EVAL_SIZE):
+        tag = "%s %s" % (self.evaluator.__class__.__name__, "centipawns" if self.centipawns else "pawns")
+        self.store = PersistentTranspositionTable(path, self.TABLE_SIZE, eval_size, tag)
+        self.tt = self.store
+        self.transposition_table = True
+
+    def flush_store(self):
+        if self.store is not None:
+            self.store.flush()
+
+    # moves the transposition table to shared memory, so processes forked
+    # later (e.g. a ponder search) fill the table this agent searches with;
+    # a store is a shared file mapping with its own locks already
+    def share_table(self):
+        if self.transposition_table and not isinstance(self.tt, (SharedTranspositionTable, PersistentTranspositionTable)):
+            self.tt = SharedTranspositionTable(self.TABLE_SIZE)
+
+    # starts the statistics of a new search
+    def start_stats(self):
+        self.stats.reset()
+        self.eval_calls_base = self.evaluator.calls
+        self.eval_cache_hits_base = self.evaluator.cache_hits
+
+    # folds the nodes and evaluations of the iteration just run into self.stats;
+    # a completed iteration is also recorded and passed to iteration_callback
+    def end_iteration(self, depth, seconds, completed=True):
+        stats = self.stats
+        stats.nodes += self.nodes
+        stats.qnodes += self.qnodes
+        calls = self.evaluator.calls
+        cache_hits = self.evaluator.cache_hits
+        stats.eval_calls += calls - self.eval_calls_base
+        stats.eval_cache_hits += cache_hits - self.eval_cache_hits_base
+        self.eval_calls_base = calls
+        self.eval_cache_hits_base = cache_hits
+        if completed:
+            stats.end_iteration(depth, seconds, self.nodes + self.qnodes)
+            if self.iteration_callback is not None:
+                self.iteration_callback(stats)
+
+    # replaces the board by a SearchBoard copy before a search, if enabled
+    def prepare_board(self):
+        if self.fast_board and not isinstance(self.board, SearchBoard) and not self.board.chess960:
+            self.board = SearchBoard.from_board(self.board)
+
+    # pops moves pushed by a search that was aborted half way
+    def restore_board(self, root_ply):
+        while len(self.board.move_stack) > root_ply:
+            self.board.pop()
+
+    # searches the root moves at depth within (alpha, beta) and returns the best
+    # value and move; the value is a bound when it falls outside the window.
+    # Each move's score and subtree size are recorded to order the next iteration
+    def root_value(self, depth, alpha, beta, color, root_moves):
+        self.pv_length[0] = 0
+        self.key_stack.append(self.board.zobrist_hash())
+        best_value = float("-inf")
+        best_move = None
+        for i, move in enumerate(root_moves):
+            nodes_before = self.nodes + self.qnodes
+            self.nodes += 1
+            self.board.push(move)
+            v = self.pvs_child_value(i, depth - 1, alpha, beta, color, 1)
+            self.board.pop()
+            self.root_scores[move] = v
+            self.root_nodes[move] = self.nodes + self.qnodes - nodes_before
+            if v > best_value:
+                best_value = v
+                best_move = move
+                self.root_best_move = move
+                self.update_pv(0, move)
+            if self.abpruning:
+                alpha = max(alpha, v)
+                if alpha >= beta:
+                    break
+        self.key_stack.pop()
+        return best_value, best_move
+
+    # orders the root moves: the previous best move, then by the previous
+    # iteration's scores and subtree sizes; the first iteration uses the
+    # move ordering heuristics and the hash move from an earlier search
+    def order_root_moves(self, best_move):
+        root_moves = list(self.board.legal_moves)
+        if self.root_scores:
+            scores = self.root_scores
+            nodes = self.root_nodes
+            return sorted(root_moves, reverse=True,
+                          key=lambda move: (move == best_move, scores.get(move, float("-inf")), nodes.get(move, 0)))
+
+        tt_move = None
+        if self.transposition_table:
+            table_entry = self.tt.probe(self.board.zobrist_hash())
+            if table_entry is not None:
+                tt_move = table_entry[0]
+        if self.move_ordering:
+            return self.orderer.order(self.board, root_moves, 0, tt_move)
+        if tt_move in root_moves:
+            root_moves.insert(0, root_moves.pop(root_moves.index(tt_move)))
+        return root_moves
+
+    # returns the move associated with the highest negamax value; clock and
+    # increment (seconds) give the remaining time on our clock, if any
+    def negamax_search(self, clock=None, increment=0, moves_to_go=None):
+        return self.search(clock, increment, moves_to_go).best_move
+
+    # iterative-deepening negamax search returning a SearchResult
+    def search(self, clock=None, increment=0, moves_to_go=None):
         color = 1 if self.board.turn else -1
-        for depth in range(1, self.max_depth):
+        if self.transposition_table:
+            self.tt.new_search()
+        self.orderer.new_search()
+        self.time_manager.start(clock, increment, moves_to_go)
+        self.prepare_board()
+        self.seed_key_stack()
+        self.start_stats()
+        root_ply = len(self.board.move_stack)
+        self.nodes = 0
+        self.qnodes = 0
+
+        best_move = None
+        best_value = None
+        result = SearchResult(None, None, [], 0)
+        self.root_scores = {}
+        self.root_nodes = {}
+        for depth in range(1, self.max_depth + 1):
+            depth += self.depth_offset
+            if best_move is not None and not self.time_manager.can_start_iteration():
+                break
+
             iter_start = timer()
-            depth += 1
-            alpha = float("-inf")
-            beta = float("+inf")
-            best_move = None
-            best_value = float("-inf")
+            self.time_manager.new_iteration(self.nodes + self.qnodes)
             self.nodes = 0
+            self.qnodes = 0
+            self.root_best_move = None
 
-            for move in self.board.legal_moves:
-                self.nodes += 1
-                self.board.push(move)
-                v = -self.negamax_value(depth - 1, -beta, -alpha, -color)
-                self.board.pop()
-                if self.abpruning:
-                    alpha = max(alpha, v)
-                if v > best_value:
-                    best_value = v
-                    best_move = move
+            root_moves = self.order_root_moves(best_move)
+            self.root_scores = {}
+            self.root_nodes = {}
+
+            # aspiration window around the previous score, widened on failure
+            alpha = float("-inf")
+            beta = float("+inf")
+            delta = self.aspiration_window
+            if self.aspiration and self.abpruning and best_value is not None and abs(best_value) < self.mate_bound:
+                alpha = best_value - delta
+                beta = best_value + delta
+
+            try:
+                while True:
+                    value, iter_move = self.root_value(depth, alpha, beta, color, root_moves)
+                    if value <= alpha and alpha != float("-inf"):
+                        delta *= 2
+                        alpha = value - delta
+                    elif value >= beta and beta != float("+inf"):
+                        delta *= 2
+                        beta = value + delta
+                    else:
+                        break
+            except SearchTimeout:
+                # keep the last completed iteration, unless there is none
+                self.restore_board(root_ply)
+                self.end_iteration(depth, timer() - iter_start, completed=False)
+                if best_move is None:
+                    best_move = self.root_best_move
+                if self.verbose:
+                    print
+                    print str(depth) + "-ply aborted after", self.time_manager.elapsed(), "seconds"
+                break
+            best_value = value
+            best_move = iter_move
+            result = SearchResult(best_move, best_value, self.pv_table[0][:self.pv_length[0]], depth)
+            self.end_iteration(depth, timer() - iter_start)
 
             if self.verbose:
                 iter_end = timer()
@@ -134,37 +641,178 @@ class DeepCrimsonAgent():
                 print
                 print str(depth) + "-ply"
                 print "nodes", self.nodes
+                print "qnodes", self.qnodes
                 print "time", seconds
                 print "kn/s", self.nodes / 1000.0 / seconds
+                if self.move_ordering:
+                    print "first-move cutoffs", self.orderer.first_move_cutoff_rate()
                 print "move", best_move
+                print "pv", " ".join(str(move) for move in result.pv)
+
+        if best_move is None:
+            best_move = next(iter(self.board.legal_moves), None)
+        if result.best_move != best_move:
+            result = SearchResult(best_move, None, [best_move] if best_move else [], 0)
+        self.last_result = result
+        return result
+
+    # Multi-PV: iterative deepening that finds the best k root moves, each with its
+    # own exact score and PV, returned as a list of SearchResults (best first).
+    # Line j is a full-window search of the root without the moves of lines
+    # 1..j-1, so the lines share the transposition table and move ordering
+    def multipv_search(self, k, clock=None, increment=0, moves_to_go=None):
+        color = 1 if self.board.turn else -1
+        if self.transposition_table:
+            self.tt.new_search()
+        self.orderer.new_search()
+        self.time_manager.start(clock, increment, moves_to_go)
+        self.prepare_board()
+        self.seed_key_stack()
+        self.start_stats()
+        root_ply = len(self.board.move_stack)
+        self.nodes = 0
+        self.qnodes = 0
+
+        k = min(k, len(list(self.board.legal_moves)))
+        lines = []
+        # nodes spent on each line in the last completed iteration
+        self.line_nodes = []
+        self.root_scores = {}
+        self.root_nodes = {}
+        for depth in range(1, self.max_depth + 1):
+            if lines and not self.time_manager.can_start_iteration():
+                break
 
-        return best_move
+            iter_start = timer()
+            self.time_manager.new_iteration(self.nodes + self.qnodes)
+            self.nodes = 0
+            self.qnodes = 0
+            self.root_best_move = None
+
+            # the previous iteration's lines go first, in their order
+            ordered = self.order_root_moves(lines[0].best_move if lines else None)
+            previous = [line.best_move for line in lines]
+            ordered = previous + [move for move in ordered if move not in previous]
+            self.root_scores = {}
+            self.root_nodes = {}
+
+            iter_lines = []
+            line_nodes = []
+            excluded = set()
+            try:
+                for _ in range(k):
+                    nodes_before = self.nodes + self.qnodes
+                    root_moves = [move for move in ordered if move not in excluded]
+                    value, move = self.root_value(depth, float("-inf"), float("+inf"), color, root_moves)
+                    iter_lines.append(SearchResult(move, value, self.pv_table[0][:self.pv_length[0]], depth))
+                    line_nodes.append(self.nodes + self.qnodes - nodes_before)
+                    excluded.add(move)
+            except SearchTimeout:
+                self.restore_board(root_ply)
+                self.end_iteration(depth, timer() - iter_start, completed=False)
+                if self.verbose:
+                    print
+                    print str(depth) + "-ply aborted after", self.time_manager.elapsed(), "seconds"
+                break
+            lines = iter_lines
+            self.line_nodes = line_nodes
+            self.end_iteration(depth, timer() - iter_start)
 
-    # calculates the MTD-(f) value of the current board state
+            if self.verbose:
+                seconds = timer() - iter_start
+                print
+                print str(depth) + "-ply"
+                print "nodes", self.nodes
+                print "qnodes", self.qnodes
+                print "time", seconds
+                for i, line in enumerate(lines):
+                    print "line", i + 1, line.score, " ".join(str(move) for move in line.pv), "(%d nodes)" % line_nodes[i]
+
+        self.last_result = lines[0] if lines else None
+        return lines
+
+    # Lazy SMP: runs negamax_search while workers - 1 helper processes search the
+    # same root at staggered depths, all sharing one transposition table; the
+    # helpers only fill the table and the main search's move is returned
+    def parallel_search(self, clock=None, increment=0, moves_to_go=None):
+        stop_flag = multiprocessing.RawValue('b', 0)
+        helpers = []
+        for worker_id in range(1, self.workers):
+            helper = multiprocessing.Process(target=run_helper, args=(self, worker_id, stop_flag))
+            helper.daemon = True
+            helper.start()
+            helpers.append(helper)
+
+        try:
+            return self.negamax_search(clock, increment, moves_to_go)
+        finally:
+            # helpers notice the flag at their next time check and exit cleanly,
+            # so none of them dies while holding a table lock
+            stop_flag.value = 1
+            for helper in helpers:
+                helper.join()
+
+    # calculates the MTD-(f) value of the current board state; each pass is a
+    # null-window search mtdf_granularity wide, counted in self.passes, and the
+    # passes stop once the value is known to within mtdf_granularity
     def mtdf_value(self, f, depth, color):
+        step = self.mtdf_granularity
         g = f
         upper_bound = float("+inf")
         lower_bound = float("-inf")
-        while lower_bound < upper_bound:
-            beta = max(g, lower_bound+1)
-            g = self.negamax_value(depth, beta-1, beta, color)
+        self.passes = 0
+        while upper_bound - lower_bound >= step:
+            beta = max(g, lower_bound+step)
+            g = self.negamax_value(depth, beta-step, beta, color)
+            self.passes += 1
             if g < beta:
                 upper_bound = g
             else:
                 lower_bound = g
         return g
 
-    # returns the move associated with the highest MTD-(f) value
-    def mtdf_search(self):
+    # returns the move associated with the highest MTD-(f) value; clock and
+    # increment (seconds) give the remaining time on our clock, if any
+    def mtdf_search(self, clock=None, increment=0, moves_to_go=None):
         color = 1 if self.board.turn else -1
         key = self.board.zobrist_hash()
-        index = key % self.TABLE_SIZE
+        self.tt.new_search()
+        self.orderer.new_search()
+        self.time_manager.start(clock, increment, moves_to_go)
+        self.prepare_board()
+        self.seed_key_stack()
+        self.start_stats()
+        root_ply = len(self.board.move_stack)
+        self.nodes = 0
+        self.qnodes = 0
 
         f = 0
+        best_move = None
+        self.mtdf_passes = []
         for depth in range(1, self.max_depth + 1):
+            if best_move is not None and not self.time_manager.can_start_iteration():
+                break
+
             iter_start = timer()
+            self.time_manager.new_iteration(self.nodes + self.qnodes)
             self.nodes = 0
-            f = self.mtdf_value(f, depth, color)
+            self.qnodes = 0
+            try:
+                f = self.mtdf_value(f, depth, color)
+                self.mtdf_passes.append(self.passes)
+            except SearchTimeout:
+                self.restore_board(root_ply)
+                self.end_iteration(depth, timer() - iter_start, completed=False)
+                if self.verbose:
+                    print
+                    print str(depth) + "-ply aborted after", self.time_manager.elapsed(), "seconds"
+                break
+
+            # remember the best move of the last completed depth
+            table_entry = self.tt.probe(key)
+            if table_entry is not None:
+                best_move = table_entry[0]
+            self.end_iteration(depth, timer() - iter_start)
 
             if self.verbose:
                 iter_end = timer()
@@ -172,28 +820,32 @@ class DeepCrimsonAgent():
                 print
                 print str(depth) + "-ply"
                 print "nodes", self.nodes
+                print "qnodes", self.qnodes
                 print "time", seconds
                 print "kn/s", self.nodes / 1000.0 / seconds
-                table_entry = self.tt[index]
-                if table_entry is not None and table_entry.zobrist_key == key:
-                    print "move", table_entry.best_move
-                else:
-                    print "move", None
+                if self.move_ordering:
+                    print "first-move cutoffs", self.orderer.first_move_cutoff_rate()
+                print "move", best_move
                 print "value:", f
+                print "mtd(f) passes", self.passes
 
-        # read best move from transposition table
-        table_entry = self.tt[index]
-        if table_entry is not None and table_entry.zobrist_key == key:
-            return table_entry.best_move
-        else:
-            print "current position not in transposition table!"
-            return None
+        if best_move is None:
+            best_move = next(iter(self.board.legal_moves), None)
+        return best_move
 
     # e.g. self.move(self.search()) updates internal board representation with best move found by NegaMax search
     def move(self, move):
         self.board.push(move)
 
 
+# entry point of a Lazy SMP helper process forked by parallel_search
+def run_helper(agent, worker_id, stop_flag):
+    agent.verbose = False
+    agent.depth_offset = worker_id % 2
+    agent.time_manager = TimeManager(stop_flag=stop_flag)
+    agent.negamax_search()
+
+
 # if __name__ == '__main__':
     # print "\nTACTIC 1 -- Mate in 5"
     # test_board = chess.Board("1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1")
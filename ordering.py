@@ -0,0 +1,108 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# ordering.py
+# This file has the move ordering heuristics used by our search agents:
+# MVV-LVA for captures, two killer moves per ply and a from/to history table.
+# Captures that lose material by static exchange evaluation go last.
+
+import chess
+from see import is_losing
+
+# deepest ply that keeps its own killer slots
+MAX_PLY = 64
+
+# piece values used to rank victims and attackers (index by piece type)
+MVV_LVA_VALUES = [0, 1, 3, 3, 5, 9, 20]
+
+# score bands keep the move classes apart: hash move, captures, killers,
+# history, losing captures
+TT_MOVE_SCORE = 4000000
+CAPTURE_SCORE = 3000000
+KILLER_SCORES = [2000000, 1999999]
+LOSING_CAPTURE_SCORE = -1000000
+
+# history scores are halved once any of them passes this value
+HISTORY_LIMIT = 1000000
+
+
+class MoveOrderer():
+    def __init__(self, see=True):
+        # whether to tell losing captures apart with static exchange evaluation
+        self.see = see
+
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        self.history = [0] * (64 * 64)
+
+        # counters for the share of cutoffs produced by the first move searched
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    # prepares for a new search: killers are forgotten and history is aged
+    def new_search(self):
+        self.killers = [[None, None] for _ in range(MAX_PLY)]
+        for i in range(len(self.history)):
+            self.history[i] >>= 1
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+
+    # most valuable victim, least valuable attacker score of a capture
+    def mvv_lva(self, board, move):
+        victim = board.piece_type_at(move.to_square)
+        if victim is None:
+            # en passant
+            victim = chess.PAWN
+        attacker = board.piece_type_at(move.from_square)
+        return MVV_LVA_VALUES[victim] * 10 - MVV_LVA_VALUES[attacker]
+
+    # ordering score of a single move at the given ply
+    def score(self, board, move, ply, tt_move=None):
+        if move == tt_move:
+            return TT_MOVE_SCORE
+        if board.is_capture(move):
+            if self.see and is_losing(board, move):
+                return LOSING_CAPTURE_SCORE + self.mvv_lva(board, move) + (move.promotion or 0)
+            return CAPTURE_SCORE + self.mvv_lva(board, move) + (move.promotion or 0)
+        if move.promotion:
+            return CAPTURE_SCORE + move.promotion
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if move == killers[0]:
+                return KILLER_SCORES[0]
+            if move == killers[1]:
+                return KILLER_SCORES[1]
+        return self.history[move.from_square * 64 + move.to_square]
+
+    # whether move is one of the killer moves stored for ply
+    def is_killer(self, move, ply):
+        return ply < MAX_PLY and (move == self.killers[ply][0] or move == self.killers[ply][1])
+
+    # returns the moves as a list, best candidates first
+    def order(self, board, moves, ply, tt_move=None):
+        return sorted(moves, key=lambda move: self.score(board, move, ply, tt_move), reverse=True)
+
+    # updates the killers and history after move caused a beta cutoff; the
+    # board must still be in the position before move was played
+    def record_cutoff(self, board, move, depth, ply, move_index):
+        self.cutoffs += 1
+        if move_index == 0:
+            self.first_move_cutoffs += 1
+
+        if board.is_capture(move) or move.promotion:
+            return
+
+        if ply < MAX_PLY:
+            killers = self.killers[ply]
+            if move != killers[0]:
+                killers[1] = killers[0]
+                killers[0] = move
+
+        index = move.from_square * 64 + move.to_square
+        self.history[index] += depth * depth
+        if self.history[index] > HISTORY_LIMIT:
+            for i in range(len(self.history)):
+                self.history[i] >>= 1
+
+    # fraction of beta cutoffs caused by the first move searched
+    def first_move_cutoff_rate(self):
+        if self.cutoffs == 0:
+            return 0.0
+        return float(self.first_move_cutoffs) / self.cutoffs
@@ -3,6 +3,8 @@
 # This file has the functions and logic for the GUI as well as setting
 # the players in the game and interacting with those agents.
 
+import atexit
+import multiprocessing
 import time
 import traceback
 
@@ -13,6 +15,25 @@ import chess.uci
 import sunfish
 
 import main
+import pns
+from timemanager import TimeManager
+
+# node table and seconds the mate solver gets before each search of the agent,
+# and the largest share of the agent's time per move it may take
+MATE_SOLVER_NODES = 20000
+MATE_SOLVER_TIME = 0.5
+MATE_SOLVER_SHARE = 0.25
+
+# entry point of the process an AgentPlayer ponders in: searches board, the
+# position after the expected reply, until it is done or stop_flag is set, and
+# sends the move found and the depth it completed through conn
+def run_ponder(agent, board, stop_flag, conn, negamax):
+    agent.verbose = False
+    agent.board = board
+    agent.time_manager = TimeManager(stop_flag=stop_flag)
+    move = agent.negamax_search() if negamax else agent.mtdf_search()
+    conn.send((move.uci() if move else None, agent.stats.depth))
+    conn.close()
 
 # turn a UCI move into move readable by Sunfish
 def create_move(board, crdn):
@@ -94,14 +115,36 @@ class Human(Player):
 
 # Class representing our AI agent
 class AgentPlayer(Player):
-    def __init__(self, verbose, negamax_search=True, eval_simple=True, depth=2, opening_book=True):
+    def __init__(self, verbose, negamax_search=True, eval_simple=True, depth=2, opening_book=True, max_time=None, mate_solver=False, store=None, ponder=False):
         self._depth = depth
         self._opening_book = opening_book
         self._negamax = negamax_search
+        self._max_time = max_time
+        self._solver = None
+        if mate_solver:
+            solver_time = MATE_SOLVER_TIME if max_time is None else min(MATE_SOLVER_TIME, max_time * MATE_SOLVER_SHARE)
+            self._solver = pns.MateSolver(max_nodes=MATE_SOLVER_NODES, max_time=solver_time)
         if eval_simple:
-            self._agent = main.DeepCrimsonAgent(chess.Board(), max_depth=depth, evaluation_type=main.EvalType.SIMPLE, verbose=verbose)
+            self._agent = main.DeepCrimsonAgent(chess.Board(), max_depth=depth, evaluation_type=main.EvalType.SIMPLE, max_time=max_time, verbose=verbose)
         else:
-            self._agent = main.DeepCrimsonAgent(chess.Board(), max_depth=depth, evaluation_type=main.EvalType.COMPLEX, verbose=verbose)
+            self._agent = main.DeepCrimsonAgent(chess.Board(), max_depth=depth, evaluation_type=main.EvalType.COMPLEX, max_time=max_time, verbose=verbose)
+
+        # with a store path the agent searches from the table file left by
+        # earlier games, and writes it back when the program exits
+        if store is not None:
+            self._agent.attach_store(store)
+            atexit.register(self._agent.flush_store)
+
+        # with ponder, a background process searches the expected reply while
+        # the opponent thinks, filling the shared transposition table
+        self._ponder = ponder and self._agent.transposition_table
+        self._pondering = None
+        self.ponder_hits = 0
+        self.ponder_misses = 0
+        # depth completed by the ponder search of the last ponder hit
+        self.ponder_depth = None
+        if self._ponder:
+            self._agent.share_table()
 
     def search_with_opening_book(self,board):
         reader = chess.polyglot.open_reader('komodo.bin')
@@ -115,31 +158,98 @@ class AgentPlayer(Player):
         else:
             return random.choice(moves)
 
+    # plays a forced mate if the mate solver proves one, else searches in what
+    # is left of max_time once the solver is done
+    def search(self, board):
+        clock = None
+        if self._solver is not None:
+            if self._solver.solve(board) == pns.MateResult.PROVEN:
+                return self._solver.move
+            if self._max_time is not None:
+                clock = max(0.0, self._max_time - self._solver.time_manager.elapsed())
+        if self._negamax:
+            return self._agent.negamax_search(clock, moves_to_go=1)
+        return self._agent.mtdf_search(clock, moves_to_go=1)
+
+    # the reply the last search expects to move, from the transposition table
+    def expected_reply(self, board, move):
+        after = board.copy()
+        after.push(move)
+        entry = self._agent.tt.probe(after.zobrist_hash())
+        if entry is not None and entry[0] in after.legal_moves:
+            return entry[0]
+        return None
+
+    # starts pondering on the position after move and its expected reply
+    def start_pondering(self, board, move):
+        reply = self.expected_reply(board, move)
+        if reply is None:
+            return
+        ponder_board = board.copy()
+        ponder_board.push(move)
+        ponder_board.push(reply)
+        stop_flag = multiprocessing.RawValue('b', 0)
+        reader, writer = multiprocessing.Pipe(False)
+        process = multiprocessing.Process(target=run_ponder,
+                                          args=(self._agent, ponder_board, stop_flag, writer, self._negamax))
+        process.daemon = True
+        process.start()
+        writer.close()
+        self._pondering = (ponder_board.fen(), process, stop_flag, reader)
+
+    # ends pondering now that the opponent moved to board; on a ponder hit the
+    # ponder search runs on to its depth limit, or until our time for this move
+    # is used up, and its move is returned. On a miss it is stopped and None is
+    # returned. The table stays warm either way
+    def stop_pondering(self, board):
+        if self._pondering is None:
+            return None
+        fen, process, stop_flag, reader = self._pondering
+        self._pondering = None
+        move = None
+        if board.fen() == fen:
+            self.ponder_hits += 1
+            if self._max_time is not None and not reader.poll(self._max_time):
+                stop_flag.value = 1
+            try:
+                uci, self.ponder_depth = reader.recv()
+                move = chess.Move.from_uci(uci)
+            except (EOFError, TypeError):
+                move = None
+        else:
+            self.ponder_misses += 1
+            stop_flag.value = 1
+        process.join()
+        if move not in board.legal_moves:
+            return None
+        return move
+
     def move(self, gn_current):
         # assert gn_current.board().turn == True
 
         board = gn_current.board()
+        pondered = self.stop_pondering(board)
         self._agent.board = board
         t0 = time.time()
 
-        # checks opening book moves if agent uses opening book
-        if self._opening_book:
+        # a ponder hit has its move already; otherwise checks opening book
+        # moves if agent uses opening book
+        if pondered is not None:
+            uci_move = str(pondered)
+        elif self._opening_book:
             uci_move = str(self.search_with_opening_book(board))
             if uci_move == "0000":
                 self._opening_book = False
-                if self._negamax:
-                    uci_move = str(self._agent.negamax_search())
-                else:
-                    uci_move = str(self._agent.mtdf_search())
+                uci_move = str(self.search(board))
         else:
-            if self._negamax:
-                uci_move = str(self._agent.negamax_search())
-            else:
-                uci_move = str(self._agent.mtdf_search())
+            uci_move = str(self.search(board))
 
         move = create_move(gn_current.board(), uci_move)
         print time.time() - t0, move
 
+        if self._ponder:
+            self.start_pondering(gn_current.board(), move)
+
         gn_new = chess.pgn.GameNode()
         gn_new.parent = gn_current
         gn_new.move = move
@@ -151,7 +261,7 @@ def play():
     gn_current = chess.pgn.Game()
 
     # Define the two players
-    player_a = AgentPlayer(True, depth=6)
+    player_a = AgentPlayer(True, depth=6, ponder=True)
     player_b = Sunfish(maxn=4)
 
     times = {'A': 0.0, 'B': 0.0}
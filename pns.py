@@ -0,0 +1,234 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# pns.py
+# This file has our mate solver: a proof-number search that proves or
+# disproves that the side to move can force checkmate. It grows the game tree
+# best-first towards the positions that are cheapest to prove or refute, so a
+# narrow forcing line is found long before a full-width search reaches its
+# depth. The tree is kept in a node table bounded by max_nodes.
+
+import chess
+from searchboard import SearchBoard
+from timemanager import TimeManager, SearchTimeout
+
+# proof and disproof number of a solved node
+INFINITY = 10 ** 9
+
+# default bound on the number of nodes held in the tree
+DEFAULT_MAX_NODES = 100000
+
+
+class MateResult:
+    PROVEN = 1      # the side to move forces checkmate
+    DISPROVEN = 2   # no forced checkmate exists (within max_plies)
+    UNKNOWN = 3     # the node table or the time ran out first
+
+
+# a position of the proof tree, reached from its parent by move; nodes at even
+# plies have the attacker (the side to move at the root) to move
+class Node(object):
+    __slots__ = ['move', 'parent', 'ply', 'children', 'proof', 'disproof', 'distance']
+
+    def __init__(self, move, parent, ply):
+        self.move = move
+        self.parent = parent
+        self.ply = ply
+        # None until the node is expanded
+        self.children = None
+        self.proof = 1
+        self.disproof = 1
+        # plies to mate once the node is proven, against the longest defence
+        self.distance = None
+
+
+class MateSolver():
+    def __init__(self, max_nodes=DEFAULT_MAX_NODES, max_time=None, max_plies=None):
+        # bound on the tree size, seconds per solve and plies of the longest
+        # mate looked for (None for no limit)
+        self.max_nodes = max_nodes
+        self.time_manager = TimeManager(max_time=max_time)
+        self.max_plies = max_plies
+
+        self.board = None
+        self.root = None
+        self.size = 0
+        self.expanded = 0
+
+        # zobrist keys of the game history and of the path to the current node:
+        # a mate never needs to repeat a position, so a repetition is a draw
+        self.keys = set()
+
+        # outcome of the last solve: a mating move and line, and its length
+        self.result = None
+        self.move = None
+        self.pv = []
+        self.mate_plies = None
+
+    # tries to prove a forced mate for the side to move on board; returns a
+    # MateResult and leaves the mating move in self.move
+    def solve(self, board):
+        self.board = SearchBoard.from_board(board) if not board.chess960 else board.copy()
+        self.time_manager.start()
+        self.keys = self.history_keys()
+        self.root = Node(None, None, 0)
+        self.size = 1
+        self.expanded = 0
+        self.move = None
+        self.pv = []
+        self.mate_plies = None
+
+        try:
+            while self.root.proof != 0 and self.root.disproof != 0:
+                if self.size >= self.max_nodes:
+                    break
+                if self.expanded >= self.time_manager.next_check:
+                    self.time_manager.check(self.expanded)
+                self.iterate()
+        except SearchTimeout:
+            # unwind the path of the interrupted iteration
+            while len(self.board.move_stack) > len(board.move_stack):
+                self.board.pop()
+
+        if self.root.proof == 0:
+            self.result = MateResult.PROVEN
+            self.pv = self.principal_variation()
+            self.move = self.pv[0]
+            self.mate_plies = self.root.distance
+        elif self.root.disproof == 0:
+            self.result = MateResult.DISPROVEN
+        else:
+            self.result = MateResult.UNKNOWN
+        return self.result
+
+    # zobrist keys of the positions since the last capture or pawn move
+    def history_keys(self):
+        board = self.board.copy()
+        keys = set([board.zobrist_hash()])
+        for _ in range(min(board.halfmove_clock, len(board.move_stack))):
+            board.pop()
+            keys.add(board.zobrist_hash())
+        return keys
+
+    # one proof-number iteration: walk down to the most-proving node, expand
+    # it and back the new numbers up to the root
+    def iterate(self):
+        board = self.board
+        node = self.root
+        while node.children is not None:
+            if node.ply % 2 == 0:
+                node = min(node.children, key=lambda child: child.proof)
+            else:
+                node = min(node.children, key=lambda child: child.disproof)
+            board.push(node.move)
+            self.keys.add(board.zobrist_hash())
+
+        self.expand(node)
+
+        while True:
+            self.update(node)
+            if node is self.root:
+                break
+            self.keys.discard(board.zobrist_hash())
+            board.pop()
+            node = node.parent
+
+    # creates the children of node, the position on the board
+    def expand(self, node):
+        board = self.board
+        self.expanded += 1
+        node.children = []
+        if self.max_plies is not None and node.ply >= self.max_plies:
+            # no mate within the ply limit below this node
+            return
+        for move in board.generate_legal_moves():
+            board.push(move)
+            child = Node(move, node, node.ply + 1)
+            self.initialize(child)
+            board.pop()
+            node.children.append(child)
+        self.size += len(node.children)
+
+    # sets the first proof and disproof numbers of child, the position on the
+    # board: terminal positions are solved, others count the defender's replies
+    def initialize(self, child):
+        board = self.board
+        attacker_to_move = child.ply % 2 == 0
+        if (board.zobrist_hash() in self.keys or board.halfmove_clock >= 100
+                or board.is_insufficient_material()):
+            child.proof, child.disproof = INFINITY, 0
+            return
+        if not attacker_to_move or board.is_check():
+            replies = sum(1 for _ in board.generate_legal_moves())
+            if replies == 0:
+                # checkmate or stalemate: only mating the defender proves anything
+                if not attacker_to_move and board.is_check():
+                    child.proof, child.disproof = 0, INFINITY
+                    child.distance = 0
+                else:
+                    child.proof, child.disproof = INFINITY, 0
+            elif not attacker_to_move:
+                # every reply of the defender has to be refuted
+                child.proof = replies
+            else:
+                child.disproof = replies
+
+    # recomputes the numbers of node from its children: the attacker needs one
+    # proven move, the defender one refutation
+    def update(self, node):
+        children = node.children
+        if not children:
+            # stalemate, or out of plies
+            node.proof, node.disproof = INFINITY, 0
+            return
+        if node.ply % 2 == 0:
+            node.proof = min(child.proof for child in children)
+            node.disproof = min(INFINITY, sum(child.disproof for child in children))
+        else:
+            node.proof = min(INFINITY, sum(child.proof for child in children))
+            node.disproof = min(child.disproof for child in children)
+
+        # solved subtrees are freed, keeping only what the mating line needs
+        if node.proof == 0:
+            if node.ply % 2 == 0:
+                best = min((child for child in children if child.proof == 0), key=lambda child: child.distance)
+                self.prune(node, [best])
+                node.distance = best.distance + 1
+            else:
+                node.distance = max(child.distance for child in children) + 1
+        elif node.disproof == 0:
+            self.prune(node, [])
+
+    # replaces the children of a solved node by kept
+    def prune(self, node, kept):
+        for child in node.children:
+            if child not in kept:
+                self.size -= self.subtree_size(child)
+        node.children = kept
+
+    def subtree_size(self, node):
+        return 1 + sum(self.subtree_size(child) for child in node.children or [])
+
+    # mating line of a proven root: the attacker's mating moves and the
+    # defender's longest defences
+    def principal_variation(self):
+        pv = []
+        node = self.root
+        while node.children:
+            if node.ply % 2 == 0:
+                node = node.children[0]
+            else:
+                node = max(node.children, key=lambda child: child.distance)
+            pv.append(node.move)
+        return pv
+
+
+# e.g. python pns.py "1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1"
+if __name__ == '__main__':
+    import sys
+    solver = MateSolver()
+    result = solver.solve(chess.Board(sys.argv[1]))
+    if result == MateResult.PROVEN:
+        print "mate in", (solver.mate_plies + 1) // 2, ":", " ".join(str(move) for move in solver.pv)
+    elif result == MateResult.DISPROVEN:
+        print "no forced mate"
+    else:
+        print "unknown after", solver.expanded, "expansions"
@@ -0,0 +1,426 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# searchboard.py
+# This file has the board our search agents make and unmake moves on: a
+# chess.Board whose push and pop save and restore a plain tuple of bitboards
+# and keep the polyglot zobrist key up to date as pieces move, instead of
+# building a state object per move and hashing the whole board per node.
+# A second key covering only the pawns is kept the same way, for the
+# evaluator's pawn hash table, and so are, once an evaluator asks for them
+# with track_eval, its material and piece-square sums and the piece counts.
+
+import collections
+import chess
+
+ZOBRIST = chess.POLYGLOT_RANDOM_ARRAY
+TURN_KEY = ZOBRIST[780]
+
+
+# zobrist key of the pawns of board alone, computed from scratch
+def pawn_zobrist_hash(board):
+    key = 0
+    for square in chess.scan_forward(board.pawns & board.occupied_co[chess.WHITE]):
+        key ^= ZOBRIST[64 + square]
+    for square in chess.scan_forward(board.pawns & board.occupied_co[chess.BLACK]):
+        key ^= ZOBRIST[square]
+    return key
+
+
+# piece counts are packed 4 bits per color and piece type: the shift of each
+COUNT_SHIFTS = [[0] + [4 * (6 * color + piece_type - 1) for piece_type in chess.PIECE_TYPES]
+                for color in chess.COLORS]
+
+
+# number of pieces of piece_type and color in packed piece counts
+def piece_count(counts, color, piece_type):
+    return (counts >> COUNT_SHIFTS[color][piece_type]) & 15
+
+
+# one shared chess.Move per pair of squares and per pawn promotion, so that
+# generating moves does not build new move objects
+MOVES = [[chess.Move(from_square, to_square) for to_square in chess.SQUARES] for from_square in chess.SQUARES]
+PROMOTIONS = dict(((from_square, to_square), [chess.Move(from_square, to_square, promotion)
+                                              for promotion in [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT]])
+                  for from_square in range(8, 16) + range(48, 56) for to_square in chess.SQUARES
+                  if abs(to_square - from_square) in [7, 8, 9] and (to_square < 8 or to_square >= 56))
+
+
+# polyglot key of a (clean) set of castling rights
+def castling_key(rights):
+    key = 0
+    if rights & chess.BB_H1:
+        key ^= ZOBRIST[768]
+    if rights & chess.BB_A1:
+        key ^= ZOBRIST[769]
+    if rights & chess.BB_H8:
+        key ^= ZOBRIST[770]
+    if rights & chess.BB_A8:
+        key ^= ZOBRIST[771]
+    return key
+
+
+# the state saved by SearchBoard.push; python-chess reads its stack entries
+# through transposition_key, e.g. to detect repetitions
+class SearchState(tuple):
+    __slots__ = []
+
+    def transposition_key(self):
+        return self[:12]
+
+
+class SearchBoard(chess.Board):
+    def __init__(self, fen=chess.STARTING_FEN, chess960=False):
+        # the zobrist keys of the position and of its pawns, or None when they
+        # have to be recomputed from scratch
+        self.hash = None
+        self.pawn_hash = None
+        # tables of the incremental evaluation terms (None when not tracked),
+        # and the terms: white minus black material and piece-square sums and
+        # the packed piece counts, None when they have to be recomputed
+        self.psq_tables = None
+        self.material_values = None
+        self.material = None
+        self.psq = None
+        self.counts = None
+        chess.Board.__init__(self, fen, chess960)
+
+    # a search board for the position of board, keeping the game history
+    @classmethod
+    def from_board(cls, board):
+        if board.chess960:
+            raise ValueError("SearchBoard only plays standard chess")
+        search_board = cls(None)
+        search_board.pawns = board.pawns
+        search_board.knights = board.knights
+        search_board.bishops = board.bishops
+        search_board.rooks = board.rooks
+        search_board.queens = board.queens
+        search_board.kings = board.kings
+        search_board.occupied_co[chess.WHITE] = board.occupied_co[chess.WHITE]
+        search_board.occupied_co[chess.BLACK] = board.occupied_co[chess.BLACK]
+        search_board.occupied = board.occupied
+        search_board.promoted = board.promoted
+        search_board.turn = board.turn
+        search_board.castling_rights = board.castling_rights
+        search_board.ep_square = board.ep_square
+        search_board.halfmove_clock = board.halfmove_clock
+        search_board.fullmove_number = board.fullmove_number
+        search_board.move_stack = collections.deque(board.move_stack)
+        search_board.stack = collections.deque(board.stack)
+        return search_board
+
+    # every edit of the position besides push and pop clears the stack, so the
+    # key is recomputed the next time it is needed
+    def clear_stack(self):
+        chess.Board.clear_stack(self)
+        self.hash = None
+        self.pawn_hash = None
+        self.material = None
+
+    def copy(self, stack=True):
+        board = chess.Board.copy(self, stack)
+        board.hash = self.hash
+        board.pawn_hash = self.pawn_hash
+        board.psq_tables = self.psq_tables
+        board.material_values = self.material_values
+        board.material = self.material
+        board.psq = self.psq
+        board.counts = self.counts
+        return board
+
+    def zobrist_hash(self, array=None):
+        if array is not None:
+            return chess.Board.zobrist_hash(self, array)
+        if self.hash is None:
+            self.rehash()
+        return self.hash
+
+    def rehash(self):
+        # push keeps the castling rights clean, as python-chess does
+        self.castling_rights = self.clean_castling_rights()
+        self.hash = chess.Board.zobrist_hash(self)
+        self.pawn_hash = pawn_zobrist_hash(self)
+
+    def pawn_zobrist_hash(self):
+        if self.pawn_hash is None:
+            self.rehash()
+        return self.pawn_hash
+
+    # keeps the evaluation terms of psq_tables (indexed by color, piece type
+    # and square) and material_values (by piece type) up to date from now on
+    def track_eval(self, psq_tables, material_values):
+        self.psq_tables = psq_tables
+        self.material_values = material_values
+        self.material = None
+
+    # (material, piece-square sum, packed piece counts) of the tracked tables
+    def eval_terms(self):
+        if self.material is None:
+            self.retrack()
+        return self.material, self.psq, self.counts
+
+    def retrack(self):
+        material = 0
+        psq = 0
+        counts = 0
+        for color in chess.COLORS:
+            sign = 1 if color else -1
+            for piece_type in chess.PIECE_TYPES:
+                table = self.psq_tables[color][piece_type]
+                for square in chess.scan_forward(self.pieces_mask(piece_type, color)):
+                    material += sign * self.material_values[piece_type]
+                    psq += sign * table[square]
+                    counts += 1 << COUNT_SHIFTS[color][piece_type]
+        self.material = material
+        self.psq = psq
+        self.counts = counts
+
+    # xors mask into the bitboard of piece_type
+    def toggle(self, piece_type, mask):
+        if piece_type == chess.PAWN:
+            self.pawns ^= mask
+        elif piece_type == chess.KNIGHT:
+            self.knights ^= mask
+        elif piece_type == chess.BISHOP:
+            self.bishops ^= mask
+        elif piece_type == chess.ROOK:
+            self.rooks ^= mask
+        elif piece_type == chess.QUEEN:
+            self.queens ^= mask
+        else:
+            self.kings ^= mask
+
+    # python-chess's pseudo-legal move generator, in the same order, with the
+    # squares scanned inline and the moves taken from MOVES and PROMOTIONS
+    def generate_pseudo_legal_moves(self, from_mask=chess.BB_ALL, to_mask=chess.BB_ALL):
+        turn = self.turn
+        our_pieces = self.occupied_co[turn]
+        bb_squares = chess.BB_SQUARES
+
+        # piece moves
+        non_pawns = our_pieces & ~self.pawns & from_mask
+        while non_pawns:
+            from_square = non_pawns.bit_length() - 1
+            non_pawns ^= bb_squares[from_square]
+            targets = self.attacks_mask(from_square) & ~our_pieces & to_mask
+            row = MOVES[from_square]
+            while targets:
+                to_square = targets.bit_length() - 1
+                targets ^= bb_squares[to_square]
+                yield row[to_square]
+
+        if from_mask & self.kings:
+            for move in self.generate_castling_moves(from_mask, to_mask):
+                yield move
+
+        pawns = self.pawns & our_pieces & from_mask
+        if not pawns:
+            return
+
+        # pawn captures
+        capturers = pawns
+        pawn_attacks = chess.BB_PAWN_ATTACKS[turn]
+        them = self.occupied_co[not turn] & to_mask
+        while capturers:
+            from_square = capturers.bit_length() - 1
+            capturers ^= bb_squares[from_square]
+            targets = pawn_attacks[from_square] & them
+            while targets:
+                to_square = targets.bit_length() - 1
+                targets ^= bb_squares[to_square]
+                if to_square < 8 or to_square >= 56:
+                    for move in PROMOTIONS[from_square, to_square]:
+                        yield move
+                else:
+                    yield MOVES[from_square][to_square]
+
+        # pawn advances
+        if turn:
+            single_moves = pawns << 8 & ~self.occupied
+            double_moves = single_moves << 8 & ~self.occupied & (chess.BB_RANK_3 | chess.BB_RANK_4)
+            back = -8
+        else:
+            single_moves = pawns >> 8 & ~self.occupied
+            double_moves = single_moves >> 8 & ~self.occupied & (chess.BB_RANK_6 | chess.BB_RANK_5)
+            back = 8
+        single_moves &= to_mask
+        double_moves &= to_mask
+
+        while single_moves:
+            to_square = single_moves.bit_length() - 1
+            single_moves ^= bb_squares[to_square]
+            from_square = to_square + back
+            if to_square < 8 or to_square >= 56:
+                for move in PROMOTIONS[from_square, to_square]:
+                    yield move
+            else:
+                yield MOVES[from_square][to_square]
+
+        while double_moves:
+            to_square = double_moves.bit_length() - 1
+            double_moves ^= bb_squares[to_square]
+            yield MOVES[to_square + 2 * back][to_square]
+
+        if self.ep_square:
+            for move in self.generate_pseudo_legal_ep(from_mask, to_mask):
+                yield move
+
+    # makes a pseudo-legal move (or a null move); legality is left to the
+    # caller, which can test was_into_check() afterwards
+    def push(self, move):
+        if self.hash is None:
+            self.rehash()
+        tables = self.psq_tables
+        if tables is not None and self.material is None:
+            self.retrack()
+        turn = self.turn
+        occupied_co = self.occupied_co
+        self.stack.append(SearchState((self.pawns, self.knights, self.bishops, self.rooks, self.queens,
+                                       self.kings, occupied_co[chess.WHITE], occupied_co[chess.BLACK],
+                                       self.promoted, turn, self.castling_rights, self.ep_square,
+                                       self.occupied, self.halfmove_clock, self.fullmove_number, self.hash,
+                                       self.pawn_hash, self.material, self.psq, self.counts)))
+        self.move_stack.append(move)
+
+        key = self.hash ^ TURN_KEY
+        ep_square = self.ep_square
+        if ep_square:
+            # the en passant file is only hashed when a pawn can capture there
+            if chess.BB_PAWN_ATTACKS[not turn][ep_square] & self.pawns & occupied_co[turn]:
+                key ^= ZOBRIST[772 + (ep_square & 7)]
+            self.ep_square = None
+        self.halfmove_clock += 1
+        if not turn:
+            self.fullmove_number += 1
+        self.turn = not turn
+
+        if not move:
+            self.hash = key
+            return
+        pawn_key = self.pawn_hash
+
+        from_square = move.from_square
+        to_square = move.to_square
+        from_mask = chess.BB_SQUARES[from_square]
+        to_mask = chess.BB_SQUARES[to_square]
+        us = 1 if turn else 0
+        piece_type = moved = self.piece_type_at(from_square)
+        captured = None
+        captured_square = to_square
+        rook_from = None
+
+        # captured piece
+        if to_mask & occupied_co[not turn]:
+            captured = self.piece_type_at(to_square)
+            self.toggle(captured, to_mask)
+            occupied_co[not turn] ^= to_mask
+            self.occupied ^= to_mask
+            key ^= ZOBRIST[64 * ((captured - 1) * 2 + 1 - us) + to_square]
+            if captured == chess.PAWN:
+                pawn_key ^= ZOBRIST[64 * (1 - us) + to_square]
+            self.halfmove_clock = 0
+
+        # lift the moving piece
+        self.toggle(piece_type, from_mask)
+        occupied_co[turn] ^= from_mask
+        self.occupied ^= from_mask
+        key ^= ZOBRIST[64 * ((piece_type - 1) * 2 + us) + from_square]
+
+        if piece_type == chess.PAWN:
+            self.halfmove_clock = 0
+            pawn_key ^= ZOBRIST[64 * us + from_square]
+            diff = to_square - from_square
+            if diff == 16 or diff == -16:
+                ep_square = from_square + diff // 2
+                self.ep_square = ep_square
+                if chess.BB_PAWN_ATTACKS[turn][ep_square] & self.pawns & occupied_co[not turn]:
+                    key ^= ZOBRIST[772 + (ep_square & 7)]
+            elif to_square == ep_square and (diff & 1):
+                # en passant: the captured pawn is behind the target square
+                captured = chess.PAWN
+                captured_square = to_square - 8 if turn else to_square + 8
+                captured_mask = chess.BB_SQUARES[captured_square]
+                self.pawns ^= captured_mask
+                occupied_co[not turn] ^= captured_mask
+                self.occupied ^= captured_mask
+                key ^= ZOBRIST[64 * (1 - us) + captured_square]
+                pawn_key ^= ZOBRIST[64 * (1 - us) + captured_square]
+            if move.promotion:
+                piece_type = move.promotion
+            else:
+                pawn_key ^= ZOBRIST[64 * us + to_square]
+        elif piece_type == chess.KING and (to_square - from_square == 2 or from_square - to_square == 2):
+            # castling also moves the rook
+            if to_square > from_square:
+                rook_from, rook_to = from_square + 3, from_square + 1
+            else:
+                rook_from, rook_to = from_square - 4, from_square - 1
+            rook_mask = chess.BB_SQUARES[rook_from] | chess.BB_SQUARES[rook_to]
+            self.rooks ^= rook_mask
+            occupied_co[turn] ^= rook_mask
+            self.occupied ^= rook_mask
+            key ^= ZOBRIST[64 * (6 + us) + rook_from] ^ ZOBRIST[64 * (6 + us) + rook_to]
+
+        # put the piece down
+        self.toggle(piece_type, to_mask)
+        occupied_co[turn] |= to_mask
+        self.occupied |= to_mask
+        key ^= ZOBRIST[64 * ((piece_type - 1) * 2 + us) + to_square]
+
+        # castling rights are lost by moving the king, or moving or losing a rook
+        rights = self.castling_rights
+        if rights:
+            new_rights = rights & ~from_mask & ~to_mask
+            if piece_type == chess.KING:
+                new_rights &= ~(chess.BB_RANK_1 if turn else chess.BB_RANK_8)
+            if new_rights != rights:
+                key ^= castling_key(rights) ^ castling_key(new_rights)
+                self.castling_rights = new_rights
+
+        self.hash = key
+        self.pawn_hash = pawn_key
+
+        if tables is not None:
+            sign = 1 if turn else -1
+            ours = tables[turn]
+            self.psq += sign * (ours[piece_type][to_square] - ours[moved][from_square])
+            if captured:
+                self.psq += sign * tables[not turn][captured][captured_square]
+                self.material += sign * self.material_values[captured]
+                self.counts -= 1 << COUNT_SHIFTS[not turn][captured]
+            if piece_type != moved:
+                # promotion
+                self.material += sign * (self.material_values[piece_type] - self.material_values[chess.PAWN])
+                self.counts += (1 << COUNT_SHIFTS[turn][piece_type]) - (1 << COUNT_SHIFTS[turn][chess.PAWN])
+            if rook_from is not None:
+                self.psq += sign * (ours[chess.ROOK][rook_to] - ours[chess.ROOK][rook_from])
+
+    # unmakes the last move; moves made by chess.Board.push before this board
+    # was created are unmade by python-chess
+    def pop(self):
+        state = self.stack[-1]
+        if not isinstance(state, SearchState):
+            move = chess.Board.pop(self)
+            self.hash = None
+            self.pawn_hash = None
+            self.material = None
+            return move
+        self.stack.pop()
+        (self.pawns, self.knights, self.bishops, self.rooks, self.queens, self.kings,
+         self.occupied_co[chess.WHITE], self.occupied_co[chess.BLACK], self.promoted, self.turn,
+         self.castling_rights, self.ep_square, self.occupied, self.halfmove_clock,
+         self.fullmove_number, self.hash, self.pawn_hash, self.material, self.psq, self.counts) = state
+        return self.move_stack.pop()
+
+
+# number of leaf nodes depth plies below board, counted with pseudo-legal moves
+# and the same legality test the search uses (perft)
+def perft(board, depth):
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in list(board.generate_pseudo_legal_moves()):
+        board.push(move)
+        if not board.was_into_check():
+            nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
@@ -0,0 +1,101 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# see.py
+# This file has our static exchange evaluation (SEE): the material a move wins
+# or loses once every capture on its target square has been played out, each
+# side recapturing with its least valuable piece and free to stop when
+# recapturing no longer pays. Sliders behind the capturers join the exchange
+# as the pieces in front of them leave the square (x-rays).
+
+import chess
+
+# piece values in centipawns (index by piece type); the king is worth more
+# than everything else together, so it only captures last
+SEE_VALUES = [0, 100, 300, 300, 500, 900, 10000]
+
+
+# every piece of both colors attacking square on a board whose occupied
+# squares are occupied (pieces captured in the exchange are left out of it)
+def attackers_to(board, square, occupied):
+    rank_pieces = chess.BB_RANK_MASKS[square] & occupied
+    file_pieces = chess.BB_FILE_MASKS[square] & occupied
+    diag_pieces = chess.BB_DIAG_MASKS[square] & occupied
+    queens_and_rooks = board.queens | board.rooks
+    queens_and_bishops = board.queens | board.bishops
+
+    attackers = ((chess.BB_KING_ATTACKS[square] & board.kings) |
+                 (chess.BB_KNIGHT_ATTACKS[square] & board.knights) |
+                 (chess.BB_RANK_ATTACKS[square][rank_pieces] & queens_and_rooks) |
+                 (chess.BB_FILE_ATTACKS[square][file_pieces] & queens_and_rooks) |
+                 (chess.BB_DIAG_ATTACKS[square][diag_pieces] & queens_and_bishops) |
+                 (chess.BB_PAWN_ATTACKS[chess.BLACK][square] & board.pawns & board.occupied_co[chess.WHITE]) |
+                 (chess.BB_PAWN_ATTACKS[chess.WHITE][square] & board.pawns & board.occupied_co[chess.BLACK]))
+    return attackers & occupied
+
+
+# least valuable piece among attackers, as (piece type, square) or None
+def least_valuable(board, attackers):
+    for piece_type, pieces in [(chess.PAWN, board.pawns), (chess.KNIGHT, board.knights),
+                               (chess.BISHOP, board.bishops), (chess.ROOK, board.rooks),
+                               (chess.QUEEN, board.queens), (chess.KING, board.kings)]:
+        mask = attackers & pieces
+        if mask:
+            return piece_type, (mask & -mask).bit_length() - 1
+    return None
+
+
+# material won by the side to move playing move on board, in centipawns; move
+# is pseudo-legal and may be a quiet move, which scores 0 or the piece lost
+def see(board, move):
+    from_square = move.from_square
+    to_square = move.to_square
+    occupied = board.occupied ^ chess.BB_SQUARES[from_square]
+
+    piece = board.piece_type_at(from_square)
+    captured = board.piece_type_at(to_square)
+    if captured is None and piece == chess.PAWN and (to_square - from_square) & 1:
+        # en passant: the captured pawn is behind the target square
+        captured = chess.PAWN
+        occupied ^= chess.BB_SQUARES[to_square - 8 if board.turn else to_square + 8]
+
+    # gain[d] is what the side making capture d has won if the exchange stops there
+    gain = [SEE_VALUES[captured or 0]]
+    if move.promotion:
+        gain[0] += SEE_VALUES[move.promotion] - SEE_VALUES[chess.PAWN]
+        piece = move.promotion
+
+    attackers = attackers_to(board, to_square, occupied)
+    # pieces that can stand in front of a slider on a line to the square
+    blockers = board.pawns | board.bishops | board.rooks | board.queens | board.kings
+    color = not board.turn
+    while True:
+        capturer = least_valuable(board, attackers & board.occupied_co[color])
+        if capturer is None:
+            break
+        piece_type, square = capturer
+        if piece_type == chess.KING and attackers & board.occupied_co[not color]:
+            # the king cannot capture onto a defended square
+            break
+        gain.append(SEE_VALUES[piece] - gain[-1])
+        piece = piece_type
+        occupied ^= chess.BB_SQUARES[square]
+        if chess.BB_SQUARES[square] & blockers:
+            # a slider lined up behind the capturer now sees the square
+            attackers = attackers_to(board, to_square, occupied)
+        else:
+            attackers &= occupied
+        color = not color
+
+    # each side stops the exchange as soon as capturing on loses
+    for d in range(len(gain) - 1, 0, -1):
+        gain[d - 1] = -max(-gain[d - 1], gain[d])
+    return gain[0]
+
+
+# whether move is a capture (or promotion) that clearly loses material; moves
+# taking a piece worth at least the capturer are never losing and skip the SEE
+def is_losing(board, move):
+    if not move.promotion:
+        victim = board.piece_type_at(move.to_square)
+        if victim is not None and SEE_VALUES[victim] >= SEE_VALUES[board.piece_type_at(move.from_square)]:
+            return False
+    return see(board, move) < 0
@@ -0,0 +1,478 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# stacksearch.py
+# This file has an explicit-stack version of DeepCrimsonAgent's negamax and
+# quiescence search. It visits exactly the same nodes as the recursive search,
+# but keeps its state in a list of frames, so it can stop after any number of
+# nodes and continue later, and many searches can share one process.
+
+import chess
+from timeit import default_timer as timer
+from main import NodeType, NULL_MOVE_MIN_DEPTH, LMR_MIN_DEPTH, LMR_MIN_MOVES
+from timemanager import SearchTimeout
+
+# frame kinds
+NEGAMAX = 0
+QUIESCENCE = 1
+
+# states of a negamax frame: where to continue once control returns to it
+ENTER = 0
+AFTER_NULL = 1
+NEXT_MOVE = 2
+AFTER_REDUCED = 3
+PVS_START = 4
+AFTER_NULL_WINDOW = 5
+AFTER_FULL = 6
+# states of a quiescence frame
+Q_AFTER_CHILD = 7
+
+
+class Frame(object):
+    __slots__ = ['kind', 'state', 'depth', 'alpha', 'beta', 'color', 'ply', 'null_allowed',
+                 'key', 'old_alpha', 'in_check', 'moves', 'pending', 'i', 'searched', 'move', 'best_value',
+                 'best_move', 'entry_ply', 'null_floor']
+
+    def __init__(self, kind, depth, alpha, beta, color, ply, null_allowed):
+        self.kind = kind
+        self.state = ENTER
+        self.depth = depth
+        self.alpha = alpha
+        self.beta = beta
+        self.color = color
+        # for quiescence frames ply holds the quiescence ply, and entry_ply the
+        # ply of the negamax leaf quiescence started from
+        self.ply = ply
+        self.entry_ply = 0
+        self.null_allowed = null_allowed
+
+
+class ResumableSearch():
+    def __init__(self, agent):
+        self.agent = agent
+        self.stack = []
+        self.ret = None
+        self.budget = 0
+        self.driver = None
+
+        # results, filled in as the search goes
+        self.value = None
+        self.best_move = None
+        self.depth_reached = 0
+        self.done = False
+
+    # prepares a single negamax_value(depth, alpha, beta, color, ply) call
+    def start_negamax_value(self, depth, alpha, beta, color, ply=0):
+        self.driver = self.negamax_driver(depth, alpha, beta, color, ply)
+        self.done = False
+
+    # prepares an iterative-deepening MTD(f) search, as agent.mtdf_search()
+    def start_mtdf(self, clock=None, increment=0, moves_to_go=None):
+        self.driver = self.mtdf_driver(clock, increment, moves_to_go)
+        self.done = False
+
+    # searches at most max_nodes more nodes; returns True once the search is finished
+    def step(self, max_nodes):
+        if self.done:
+            return True
+        self.budget = max_nodes
+        try:
+            next(self.driver)
+        except StopIteration:
+            self.done = True
+        return self.done
+
+    # runs the search to the end without pausing
+    def run(self):
+        while not self.step(1 << 30):
+            pass
+        return self.value
+
+    def negamax_driver(self, depth, alpha, beta, color, ply):
+        self.push_frame(NEGAMAX, depth, alpha, beta, color, ply, True)
+        while not self.run_stack():
+            yield
+        self.value = self.ret
+
+    def mtdf_driver(self, clock, increment, moves_to_go):
+        agent = self.agent
+        color = 1 if agent.board.turn else -1
+        key = agent.board.zobrist_hash()
+        agent.tt.new_search()
+        agent.orderer.new_search()
+        agent.time_manager.start(clock, increment, moves_to_go)
+        agent.prepare_board()
+        agent.seed_key_stack()
+        agent.start_stats()
+        board = agent.board
+        root_ply = len(board.move_stack)
+        agent.nodes = 0
+        agent.qnodes = 0
+
+        f = 0
+        best_move = None
+        agent.mtdf_passes = []
+        step = agent.mtdf_granularity
+        for depth in range(1, agent.max_depth + 1):
+            if best_move is not None and not agent.time_manager.can_start_iteration():
+                break
+
+            iter_start = timer()
+            agent.time_manager.new_iteration(agent.nodes + agent.qnodes)
+            agent.nodes = 0
+            agent.qnodes = 0
+            try:
+                g = f
+                upper_bound = float("+inf")
+                lower_bound = float("-inf")
+                agent.passes = 0
+                while upper_bound - lower_bound >= step:
+                    beta = max(g, lower_bound+step)
+                    self.push_frame(NEGAMAX, depth, beta-step, beta, color, 0, True)
+                    while not self.run_stack():
+                        yield
+                    g = self.ret
+                    agent.passes += 1
+                    if g < beta:
+                        upper_bound = g
+                    else:
+                        lower_bound = g
+                f = g
+                agent.mtdf_passes.append(agent.passes)
+            except SearchTimeout:
+                self.stack = []
+                agent.restore_board(root_ply)
+                agent.end_iteration(depth, timer() - iter_start, completed=False)
+                break
+
+            table_entry = agent.tt.probe(key)
+            if table_entry is not None:
+                best_move = table_entry[0]
+            agent.end_iteration(depth, timer() - iter_start)
+            self.value = f
+            self.depth_reached = depth
+            self.best_move = best_move
+
+        if best_move is None:
+            best_move = next(iter(board.legal_moves), None)
+        self.best_move = best_move
+
+    def push_frame(self, kind, depth, alpha, beta, color, ply, null_allowed):
+        self.stack.append(Frame(kind, depth, alpha, beta, color, ply, null_allowed))
+
+    # runs frames until the stack is empty (True, the value is in self.ret) or
+    # the node budget of this slice is used up (False)
+    def run_stack(self):
+        agent = self.agent
+        board = agent.board
+        stack = self.stack
+        ret = self.ret
+        inf = float("inf")
+
+        while stack:
+            frame = stack[-1]
+            state = frame.state
+
+            if state == ENTER:
+                if self.budget <= 0:
+                    self.ret = ret
+                    return False
+                self.budget -= 1
+                if agent.nodes + agent.qnodes >= agent.time_manager.next_check:
+                    agent.time_manager.check(agent.nodes + agent.qnodes)
+
+                if frame.kind == QUIESCENCE:
+                    done, ret = self.enter_quiescence(frame)
+                    if done:
+                        stack.pop()
+                    continue
+
+                depth = frame.depth
+                frame.key = None
+                if frame.ply > 0:
+                    if board.halfmove_clock >= 4:
+                        frame.key = board.zobrist_hash()
+                    if agent.is_draw(frame.key):
+                        ret = 0
+                        stack.pop()
+                        continue
+
+                if depth == 0 and agent.quiescence:
+                    # continue as a quiescence frame in place
+                    frame.kind = QUIESCENCE
+                    frame.entry_ply = frame.ply
+                    frame.ply = 0
+                    done, ret = self.enter_quiescence(frame)
+                    if done:
+                        stack.pop()
+                    continue
+                if depth == 0:
+                    ret = agent.leaf_value(frame.color, frame.ply)
+                    stack.pop()
+                    continue
+
+                frame.in_check = board.is_check()
+                legal_moves = board.legal_moves if frame.in_check else board.pseudo_legal_moves
+                tt_move = None
+                alpha = frame.alpha
+                beta = frame.beta
+                if frame.key is None:
+                    frame.key = board.zobrist_hash()
+
+                # read from the transposition table
+                if agent.transposition_table:
+                    frame.old_alpha = alpha
+                    agent.stats.tt_probes += 1
+                    table_entry = agent.tt.probe(frame.key)
+                    if table_entry is not None:
+                        agent.stats.tt_hits += 1
+                        tt_move, tt_depth, tt_value, tt_type = table_entry
+                        tt_value = agent.value_from_tt(tt_value, frame.ply)
+                        if tt_depth >= depth:
+                            if tt_type == NodeType.EXACT:
+                                agent.stats.tt_cutoffs += 1
+                                ret = tt_value
+                                stack.pop()
+                                continue
+                            elif tt_type == NodeType.BETA:
+                                alpha = max(alpha, tt_value)
+                            elif tt_type == NodeType.ALPHA:
+                                beta = min(beta, tt_value)
+                            if alpha >= beta:
+                                agent.stats.tt_cutoffs += 1
+                                ret = tt_value
+                                stack.pop()
+                                continue
+                        if not agent.move_ordering and tt_move in legal_moves:
+                            legal_moves = list(legal_moves)
+                            legal_moves.insert(0, legal_moves.pop(legal_moves.index(tt_move)))
+                frame.alpha = alpha
+                frame.beta = beta
+                agent.key_stack.append(frame.key)
+                frame.moves = legal_moves
+                # the hash move waits here until the moves are ordered
+                frame.move = tt_move
+
+                if agent.null_move and agent.abpruning and frame.null_allowed and depth >= NULL_MOVE_MIN_DEPTH \
+                        and beta != inf and not frame.in_check and agent.has_non_pawn_material():
+                    agent.nodes += 1
+                    frame.null_floor = agent.null_floor
+                    agent.null_floor = len(agent.key_stack)
+                    board.push(chess.Move.null())
+                    frame.state = AFTER_NULL
+                    self.push_frame(NEGAMAX, max(0, depth - 1 - agent.null_move_reduction), -beta,
+                                    -beta + agent.null_window, -frame.color, frame.ply + 1, False)
+                    continue
+                self.begin_moves(frame)
+                continue
+
+            if state == AFTER_NULL:
+                v = -ret
+                board.pop()
+                agent.null_floor = frame.null_floor
+                if v >= frame.beta:
+                    agent.key_stack.pop()
+                    ret = frame.beta if v >= agent.mate_bound else v
+                    stack.pop()
+                    continue
+                self.begin_moves(frame)
+                continue
+
+            if state == NEXT_MOVE:
+                if frame.i >= len(frame.moves) and frame.pending is not None:
+                    # the hash move is done: generate and order the others
+                    tt_move = frame.moves[0]
+                    frame.moves.extend(move for move in agent.orderer.order(board, frame.pending, frame.ply)
+                                       if move != tt_move)
+                    frame.pending = None
+                if frame.i >= len(frame.moves):
+                    agent.key_stack.pop()
+                    if frame.searched == 0:
+                        # no legal moves: checkmate or stalemate
+                        ret = agent.mated_value(frame.ply) if frame.in_check else 0
+                    else:
+                        ret = self.store(frame)
+                    stack.pop()
+                    continue
+                move = frame.moves[frame.i]
+                frame.move = move
+                depth = frame.depth
+                alpha = frame.alpha
+                late = agent.lmr and agent.abpruning and frame.searched >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH \
+                    and not frame.in_check and alpha != -inf and not move.promotion \
+                    and not board.is_capture(move) and not agent.orderer.is_killer(move, frame.ply)
+                board.push(move)
+                if board.was_into_check():
+                    board.pop()
+                    frame.i += 1
+                    continue
+                agent.nodes += 1
+                if late and not board.is_check():
+                    frame.state = AFTER_REDUCED
+                    self.push_frame(NEGAMAX, depth - 1 - agent.lmr_reduction, -alpha - agent.null_window,
+                                    -alpha, -frame.color, frame.ply + 1, True)
+                    continue
+                frame.state = PVS_START
+                continue
+
+            if state == AFTER_REDUCED:
+                v = -ret
+                if v > frame.alpha:
+                    frame.state = PVS_START
+                    continue
+                self.child_done(frame, v)
+                continue
+
+            if state == PVS_START:
+                alpha = frame.alpha
+                if frame.searched == 0 or not agent.pvs or not agent.abpruning or alpha == -inf:
+                    frame.state = AFTER_FULL
+                    self.push_frame(NEGAMAX, frame.depth - 1, -frame.beta, -alpha, -frame.color, frame.ply + 1, True)
+                else:
+                    frame.state = AFTER_NULL_WINDOW
+                    self.push_frame(NEGAMAX, frame.depth - 1, -alpha - agent.null_window, -alpha,
+                                    -frame.color, frame.ply + 1, True)
+                continue
+
+            if state == AFTER_NULL_WINDOW:
+                v = -ret
+                if frame.alpha < v < frame.beta:
+                    frame.state = AFTER_FULL
+                    self.push_frame(NEGAMAX, frame.depth - 1, -frame.beta, -frame.alpha, -frame.color, frame.ply + 1, True)
+                    continue
+                self.child_done(frame, v)
+                continue
+
+            if state == AFTER_FULL:
+                self.child_done(frame, -ret)
+                continue
+
+            if state == Q_AFTER_CHILD:
+                v = -ret
+                board.pop()
+                if v > frame.best_value:
+                    frame.best_value = v
+                if v > frame.alpha:
+                    frame.alpha = v
+                    if frame.alpha >= frame.beta:
+                        ret = frame.best_value
+                        stack.pop()
+                        continue
+                frame.i += 1
+                done, ret = self.next_quiescence_move(frame)
+                if done:
+                    stack.pop()
+                continue
+
+        self.ret = ret
+        return True
+
+    # orders the moves of a negamax frame (after the null move, as the recursive
+    # search does, since it may change killers and history) and starts the loop;
+    # as in ordered_moves, a hash move is searched before the rest are generated
+    def begin_moves(self, frame):
+        agent = self.agent
+        frame.pending = None
+        if not agent.move_ordering:
+            frame.moves = list(frame.moves)
+        elif frame.move is not None and frame.move in frame.moves:
+            frame.pending = frame.moves
+            frame.moves = [frame.move]
+        else:
+            frame.moves = agent.orderer.order(agent.board, frame.moves, frame.ply)
+        frame.best_value = float("-inf")
+        frame.best_move = None
+        frame.i = 0
+        frame.searched = 0
+        frame.state = NEXT_MOVE
+
+    # finishes the current move of a negamax frame with child value v
+    def child_done(self, frame, v):
+        agent = self.agent
+        agent.board.pop()
+        move = frame.move
+        if v > frame.best_value:
+            frame.best_value = v
+            frame.best_move = move
+        if agent.abpruning:
+            frame.alpha = max(frame.alpha, v)
+            if frame.alpha >= frame.beta:
+                agent.stats.beta_cutoffs += 1
+                if frame.searched == 0:
+                    agent.stats.first_move_cutoffs += 1
+                if agent.move_ordering:
+                    agent.orderer.record_cutoff(agent.board, move, frame.depth, frame.ply, frame.searched)
+                # no more moves: the next visit stores the result
+                frame.pending = None
+                frame.i = len(frame.moves)
+                frame.searched += 1
+                frame.state = NEXT_MOVE
+                return
+        frame.i += 1
+        frame.searched += 1
+        frame.state = NEXT_MOVE
+
+    # writes a finished negamax frame to the transposition table, returns its value
+    def store(self, frame):
+        agent = self.agent
+        best_value = frame.best_value
+        if agent.transposition_table:
+            if best_value <= frame.old_alpha:
+                node_type = NodeType.ALPHA
+            elif best_value >= frame.beta:
+                node_type = NodeType.BETA
+            else:
+                node_type = NodeType.EXACT
+            agent.tt.store(frame.key, frame.best_move, frame.depth, agent.value_to_tt(best_value, frame.ply),
+                           node_type)
+        return best_value
+
+    # first visit of a quiescence frame; returns (finished, value)
+    def enter_quiescence(self, frame):
+        agent = self.agent
+        board = agent.board
+        in_check = board.is_check()
+        capped = agent.qsearch_max_ply is not None and frame.ply >= agent.qsearch_max_ply
+        frame.in_check = in_check and not capped
+
+        if in_check and not capped:
+            frame.best_value = float("-inf")
+            moves = list(board.generate_legal_moves())
+        else:
+            frame.best_value = agent.mate_distance(frame.color * agent.static_value(in_check),
+                                                   frame.entry_ply + frame.ply)
+            if frame.best_value >= frame.beta or capped:
+                return True, frame.best_value
+            frame.alpha = max(frame.alpha, frame.best_value)
+            moves = agent.tactical_moves()
+
+        if agent.move_ordering:
+            moves = agent.orderer.order(board, moves, 0)
+        frame.moves = moves
+        frame.i = 0
+        return self.next_quiescence_move(frame)
+
+    # plays the next legal capture of a quiescence frame; returns (finished, value)
+    def next_quiescence_move(self, frame):
+        agent = self.agent
+        board = agent.board
+        while frame.i < len(frame.moves):
+            board.push(frame.moves[frame.i])
+            if board.was_into_check():
+                board.pop()
+                frame.i += 1
+                continue
+            agent.qnodes += 1
+            frame.state = Q_AFTER_CHILD
+            self.push_frame(QUIESCENCE, 0, -frame.beta, -frame.alpha, -frame.color, frame.ply + 1, False)
+            self.stack[-1].entry_ply = frame.entry_ply
+            return False, None
+        # checkmated: no evasion exists
+        if frame.in_check and frame.best_value == float("-inf"):
+            return True, agent.mated_value(frame.entry_ply + frame.ply)
+        return True, frame.best_value
+
+
+# runs several resumable searches in turn, slice_nodes nodes at a time, until all are finished
+def multiplex(searches, slice_nodes=1000):
+    pending = list(searches)
+    while pending:
+        pending = [search for search in pending if not search.step(slice_nodes)]
@@ -0,0 +1,70 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# stats.py
+# This file has the statistics our search agents keep about a search: node
+# counts, transposition table and cutoff counters, evaluation calls and the
+# time and nodes of every completed iteration, readable without verbose output.
+
+
+class SearchStats():
+    def __init__(self):
+        self.reset()
+
+    # forgets everything counted so far, at the start of a search
+    def reset(self):
+        # nodes searched by the main search and by quiescence, aborted
+        # iterations included
+        self.nodes = 0
+        self.qnodes = 0
+
+        # transposition table lookups, lookups finding an entry, and entries
+        # whose bound ended the node without searching it
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+
+        # beta cutoffs of the move loop, and those caused by the first move searched
+        self.beta_cutoffs = 0
+        self.first_move_cutoffs = 0
+
+        # static evaluations requested, and those answered by the evaluator's cache
+        self.eval_calls = 0
+        self.eval_cache_hits = 0
+
+        # deepest completed iteration, and the seconds and nodes of each one
+        self.depth = 0
+        self.depth_times = []
+        self.depth_nodes = []
+
+    # records a completed iteration
+    def end_iteration(self, depth, seconds, nodes):
+        self.depth = depth
+        self.depth_times.append(seconds)
+        self.depth_nodes.append(nodes)
+
+    # effective branching factor: growth in nodes from the previous completed
+    # iteration to the last one, None before two iterations are done
+    def ebf(self):
+        if len(self.depth_nodes) < 2 or self.depth_nodes[-2] == 0:
+            return None
+        return float(self.depth_nodes[-1]) / self.depth_nodes[-2]
+
+    def tt_hit_rate(self):
+        if self.tt_probes == 0:
+            return 0.0
+        return float(self.tt_hits) / self.tt_probes
+
+    def first_move_cutoff_rate(self):
+        if self.beta_cutoffs == 0:
+            return 0.0
+        return float(self.first_move_cutoffs) / self.beta_cutoffs
+
+    # the counters as a plain dictionary, e.g. to log a search as JSON
+    def as_dict(self):
+        return {'nodes': self.nodes, 'qnodes': self.qnodes, 'tt_probes': self.tt_probes,
+                'tt_hits': self.tt_hits, 'tt_cutoffs': self.tt_cutoffs, 'beta_cutoffs': self.beta_cutoffs,
+                'first_move_cutoffs': self.first_move_cutoffs, 'eval_calls': self.eval_calls,
+                'eval_cache_hits': self.eval_cache_hits, 'depth': self.depth,
+                'depth_times': list(self.depth_times), 'depth_nodes': list(self.depth_nodes), 'ebf': self.ebf()}
+
+    def __repr__(self):
+        return "SearchStats(%s)" % ", ".join("%s=%s" % item for item in sorted(self.as_dict().items()))
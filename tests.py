@@ -3,16 +3,43 @@
 # This file includes testing for the search and evaluation
 # components of our agents using various chess scenarios
 
+import time
+import random
+import pytest
+import multiprocessing
+
 import chess
+import chess.pgn
 import chess.polyglot
 from evaluator import Evaluator
+import evaluator
 import main
+import transposition
+import ordering
+import stacksearch
+import searchboard
+import see
+import pns
+import play
+import tracer
+import sunfish
+import bench
 
 # Tests for search correctness
 def test_search():
-    agent = main.DeepCrimsonAgent(chess.Board("r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15"), max_time=300, \
+    board = chess.Board("r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15")
+    agent = main.DeepCrimsonAgent(board, max_time=3, \
                                   transposition_table=True, abpruning=True)
-    agent.negamax_search()
+    t0 = time.time()
+    move = agent.negamax_search()
+    assert move in board.legal_moves
+    assert time.time() - t0 < 4
+
+    # a node budget stops the search no matter how deep it was asked to go
+    agent = main.DeepCrimsonAgent(board, max_depth=20, evaluation_type=main.EvalType.SIMPLE, max_nodes=3000)
+    assert agent.mtdf_search() in board.legal_moves
+    assert agent.time_manager.base_nodes + agent.nodes + agent.qnodes <= 3000
+    assert board.fen() == "r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15"
 
     print "TACTIC 1"
     test_board = chess.Board("1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1")
@@ -23,6 +50,511 @@ def test_search():
     print "\nTACTIC 4"
     test_board = chess.Board("5k2/6pp/R2P1p2/4p3/pr2P3/5P1P/8/6K1 w - - 1 33")
 
+# Tests for the bucketed replacement policy of the transposition table
+def test_transposition_table():
+    tt = transposition.TranspositionTable(size=transposition.BUCKET_SIZE)
+    move = chess.Move.from_uci("e7e8q")
+    tt.store(1, move, 8, 1.5, main.NodeType.EXACT)
+    assert tt.probe(1) == (move, 8, 1.5, main.NodeType.EXACT)
+    assert tt.probe(2) is None
+
+    # shallow entries fill the bucket without displacing the deep one
+    for key in range(2, 12):
+        tt.store(key, None, 1, 0.0, main.NodeType.ALPHA)
+    assert tt.probe(1)[1] == 8
+    assert tt.probe(11) is not None
+
+    # after enough searches the old deep entry becomes a replacement candidate
+    tt.new_search()
+    tt.new_search()
+    for key in range(12, 16):
+        tt.store(key, None, 2, 0.0, main.NodeType.BETA)
+    assert tt.probe(1) is None
+
+# Tests for MVV-LVA, killer and history move ordering
+def test_move_ordering():
+    orderer = ordering.MoveOrderer()
+    board = chess.Board("4k3/8/8/3q4/4P3/2N5/8/4K1R1 w - - 0 1")
+    moves = orderer.order(board, board.legal_moves, 0)
+    # pawn takes queen before knight takes queen
+    assert moves[0] == chess.Move.from_uci("e4d5")
+    assert moves[1] == chess.Move.from_uci("c3d5")
+
+    killer = chess.Move.from_uci("g1g7")
+    orderer.record_cutoff(board, killer, 3, 0, 0)
+    assert orderer.order(board, board.legal_moves, 0)[2] == killer
+    assert orderer.first_move_cutoff_rate() == 1.0
+
+# Tests that quiescence search sees the recapture beyond the horizon
+def test_quiescence():
+    board = chess.Board("4k3/8/4p3/3p4/8/8/8/3QK3 w - - 0 1")
+    agent = main.DeepCrimsonAgent(board, max_depth=1, evaluation_type=main.EvalType.SIMPLE, quiescence=False)
+    assert agent.mtdf_search() == chess.Move.from_uci("d1d5")
+    agent = main.DeepCrimsonAgent(board, max_depth=1, evaluation_type=main.EvalType.SIMPLE, quiescence=True)
+    assert agent.mtdf_search() != chess.Move.from_uci("d1d5")
+    assert agent.qnodes > 0
+
+# Principal variation search must not change the full-window value
+def test_pvs():
+    inf = float("inf")
+    for fen in ["r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15",
+                "rn1q1rk1/ppp1b1pp/3pP3/3p4/3P1B2/5NP1/PPP4P/R2Q1K1R b - - 0 13"]:
+        values = []
+        for pvs in [False, True]:
+            agent = main.DeepCrimsonAgent(chess.Board(fen), evaluation_type=main.EvalType.SIMPLE, pvs=pvs)
+            values.append(agent.negamax_value(3, -inf, inf, -1))
+        assert values[0] == values[1]
+
+# Null-move pruning and late move reductions must still find simple mates,
+# and the zugzwang guard keeps null moves out of pawn-only endings
+def test_selectivity():
+    board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1")
+    agent = main.DeepCrimsonAgent(board, max_depth=4, evaluation_type=main.EvalType.SIMPLE, null_move=True, lmr=True)
+    assert agent.negamax_search() == chess.Move.from_uci("a1a8")
+
+    agent = main.DeepCrimsonAgent(chess.Board("8/8/4k3/8/4P3/4K3/8/8 w - - 0 1"), evaluation_type=main.EvalType.SIMPLE)
+    assert not agent.has_non_pawn_material()
+
+# Lazy SMP helpers share the table and stop when the main search is done
+def test_parallel_search():
+    board = chess.Board("rn1q1rk1/ppp1b1pp/3pP3/3p4/3P1B2/5NP1/PPP4P/R2Q1K1R b - - 0 13")
+    agent = main.DeepCrimsonAgent(board, max_depth=3, evaluation_type=main.EvalType.SIMPLE, workers=2)
+    assert isinstance(agent.tt, transposition.SharedTranspositionTable)
+    assert agent.parallel_search() in board.legal_moves
+    assert not multiprocessing.active_children()
+
+# The explicit-stack search, run in small slices, matches the recursive one
+def test_resumable_search():
+    fen = "rn1q1rk1/ppp1b1pp/3pP3/3p4/3P1B2/5NP1/PPP4P/R2Q1K1R b - - 0 13"
+    agent = main.DeepCrimsonAgent(chess.Board(fen), max_depth=3, evaluation_type=main.EvalType.SIMPLE)
+    move = agent.mtdf_search()
+
+    sliced = main.DeepCrimsonAgent(chess.Board(fen), max_depth=3, evaluation_type=main.EvalType.SIMPLE)
+    other = main.DeepCrimsonAgent(chess.Board(fen), max_depth=2, evaluation_type=main.EvalType.SIMPLE)
+    searches = [stacksearch.ResumableSearch(sliced), stacksearch.ResumableSearch(other)]
+    for search in searches:
+        search.start_mtdf()
+    stacksearch.multiplex(searches, slice_nodes=50)
+
+    assert searches[0].best_move == move
+    assert (sliced.nodes, sliced.qnodes) == (agent.nodes, agent.qnodes)
+    counters = ['nodes', 'qnodes', 'tt_probes', 'tt_hits', 'tt_cutoffs', 'beta_cutoffs', 'eval_calls', 'depth_nodes']
+    assert [sliced.stats.as_dict()[name] for name in counters] == [agent.stats.as_dict()[name] for name in counters]
+    assert searches[1].depth_reached == 2
+    assert sliced.board.fen() == fen
+
+# The iterative-deepening driver returns a legal principal variation
+def test_search_result():
+    board = chess.Board("r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15")
+    agent = main.DeepCrimsonAgent(board, max_depth=4, evaluation_type=main.EvalType.SIMPLE)
+    result = agent.search()
+    assert result.depth == 4
+    assert result.pv[0] == result.best_move
+    line = board.copy()
+    for move in result.pv:
+        assert move in line.legal_moves
+        line.push(move)
+
+    board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1")
+    result = main.DeepCrimsonAgent(board, max_depth=1, evaluation_type=main.EvalType.SIMPLE).search()
+    assert result.depth == 1 and result.pv == [chess.Move.from_uci("a1a8")]
+
+# Multi-PV returns distinct root moves with exact, non-increasing scores
+def test_multipv():
+    board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1")
+    agent = main.DeepCrimsonAgent(board, max_depth=2, evaluation_type=main.EvalType.SIMPLE)
+    lines = agent.multipv_search(3)
+    assert len(lines) == 3
+    assert lines[0].best_move == chess.Move.from_uci("a1a8")
+    assert len(set(line.best_move for line in lines)) == 3
+    assert lines[0].score >= lines[1].score >= lines[2].score
+    assert all(line.pv[0] == line.best_move and line.depth == 2 for line in lines)
+
+def test_centipawns():
+    board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1")
+    assert Evaluator(centipawns=True).evaluate(board) == int(round(Evaluator().evaluate(board) * 100))
+    agent = main.DeepCrimsonAgent(board, max_depth=3, evaluation_type=main.EvalType.SIMPLE, centipawns=True)
+    assert agent.evaluator.evaluate(board) == 500
+    result = agent.search()
+    assert result.best_move == chess.Move.from_uci("a1a8")
+    assert result.score == main.MATE_SCORE - 1
+    agent = main.DeepCrimsonAgent(board, max_depth=3, evaluation_type=main.EvalType.SIMPLE, centipawns=True, mtdf_granularity=10)
+    assert agent.mtdf_search() == chess.Move.from_uci("a1a8")
+    assert len(agent.mtdf_passes) == 3 and min(agent.mtdf_passes) >= 1
+
+# MTD(f) steps one centipawn by default, so it finds the negamax move on float scores too
+def test_mtdf_granularity():
+    board = chess.Board(bench.BENCH_FENS[1])
+    agent = main.DeepCrimsonAgent(board, max_depth=3)
+    assert agent.mtdf_granularity == 0.01
+    assert main.DeepCrimsonAgent(board, centipawns=True).mtdf_granularity == 1
+    assert agent.mtdf_search() == main.DeepCrimsonAgent(board, max_depth=3).search().best_move
+
+# Mates score by their distance in plies, so a mate in 1 beats a longer one
+def test_mate_distance():
+    board = chess.Board("k7/8/1K6/8/8/8/8/5Q1R w - - 0 1")
+    mates = [chess.Move.from_uci("h1h8"), chess.Move.from_uci("f1f8")]
+    agent = main.DeepCrimsonAgent(board, max_depth=4, evaluation_type=main.EvalType.SIMPLE, centipawns=True)
+    result = agent.search()
+    assert result.best_move in mates and result.score == main.MATE_SCORE - 1
+    assert [line.score for line in agent.multipv_search(3)] == [main.MATE_SCORE - 1] * 2 + [main.MATE_SCORE - 3]
+    agent = main.DeepCrimsonAgent(board, max_depth=4, evaluation_type=main.EvalType.SIMPLE, centipawns=True)
+    assert agent.mtdf_search() in mates
+    search = stacksearch.ResumableSearch(agent)
+    search.start_mtdf()
+    assert search.run() == main.MATE_SCORE - 1 and search.best_move in mates
+
+def test_terminal_detection():
+    # a rook down, black can repeat the starting position of this game
+    board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1")
+    for uci in ["a1a2", "g8h8", "a2a1"]:
+        board.push(chess.Move.from_uci(uci))
+    agent = main.DeepCrimsonAgent(board, max_depth=1, evaluation_type=main.EvalType.SIMPLE)
+    assert agent.negamax_search() == chess.Move.from_uci("h8g8")
+    assert agent.root_scores[chess.Move.from_uci("h8g8")] == 0
+    assert len(agent.key_stack) == 3
+    assert agent.key_stack[0] == chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1").zobrist_hash()
+
+    # mates and stalemates are found from the move loop, not the evaluator
+    mated = chess.Board("R5k1/5ppp/8/8/8/8/5PPP/6K1 b - - 1 1")
+    stalemated = chess.Board("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1")
+    agent = main.DeepCrimsonAgent(mated, evaluation_type=main.EvalType.SIMPLE)
+    assert agent.negamax_value(2, float("-inf"), float("inf"), -1) == float("-inf")
+    assert main.SimpleEvaluator().evaluate(mated, check_terminal=False) == 5
+    agent = main.DeepCrimsonAgent(stalemated, evaluation_type=main.EvalType.SIMPLE)
+    assert agent.negamax_value(2, float("-inf"), float("inf"), -1) == 0
+
+    # a null move leaves the halfmove clock running, but a position does not
+    # repeat across it: here the black king triangulates back after a pass
+    board = chess.Board("6k1/8/8/8/8/8/8/R5K1 w - - 10 60")
+    agent = main.DeepCrimsonAgent(board, evaluation_type=main.EvalType.SIMPLE)
+    agent.seed_key_stack()
+    start = board.zobrist_hash()
+    agent.key_stack.append(start)
+    agent.null_floor = len(agent.key_stack)
+    board.push(chess.Move.null())
+    for uci in ["g8h8", "a1a2", "h8h7", "a2a1", "h7g8"]:
+        agent.key_stack.append(board.zobrist_hash())
+        board.push(chess.Move.from_uci(uci))
+    assert board.zobrist_hash() == start and board.halfmove_clock == 16
+    assert not agent.is_draw(start)
+    agent.null_floor = 0
+    assert agent.is_draw(start)
+
+    # fifty reversible moves
+    board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 99 80")
+    board.push(chess.Move.from_uci("a1a2"))
+    assert main.DeepCrimsonAgent(board).is_draw(None)
+
+def test_search_board():
+    # perft of the search board against python-chess, whose keys it must match
+    def legal_perft(board, depth):
+        if depth == 0:
+            return 1
+        nodes = 0
+        for move in list(board.legal_moves):
+            board.push(move)
+            nodes += legal_perft(board, depth - 1)
+            board.pop()
+        return nodes
+
+    for fen in [chess.STARTING_FEN,
+                "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1"]:
+        search_board = searchboard.SearchBoard.from_board(chess.Board(fen))
+        assert searchboard.perft(search_board, 2) == legal_perft(chess.Board(fen), 2)
+        assert search_board.fen() == fen
+
+        # incremental keys and evaluation terms along every line two plies deep
+        board = chess.Board(fen)
+        search_board.track_eval(evaluator.PST, evaluator.MATERIAL_VALUES)
+        for move in list(board.legal_moves):
+            board.push(move)
+            search_board.push(move)
+            for reply in list(board.legal_moves):
+                board.push(reply)
+                search_board.push(reply)
+                assert search_board.zobrist_hash() == board.zobrist_hash()
+                assert search_board.pawn_zobrist_hash() == searchboard.pawn_zobrist_hash(board)
+                fresh = searchboard.SearchBoard.from_board(board)
+                fresh.track_eval(evaluator.PST, evaluator.MATERIAL_VALUES)
+                assert search_board.eval_terms() == fresh.eval_terms()
+                board.pop()
+                search_board.pop()
+            board.pop()
+            search_board.pop()
+        assert search_board.zobrist_hash() == board.zobrist_hash()
+        assert search_board.pawn_zobrist_hash() == searchboard.pawn_zobrist_hash(board)
+
+    # the search runs on a copy and leaves the game history intact
+    board = chess.Board()
+    board.push(chess.Move.from_uci("e2e4"))
+    agent = main.DeepCrimsonAgent(board, max_depth=2, evaluation_type=main.EvalType.SIMPLE)
+    agent.negamax_search()
+    assert isinstance(agent.board, searchboard.SearchBoard)
+    assert agent.board.move_stack[-1] == chess.Move.from_uci("e2e4") and len(board.move_stack) == 1
+
+# Search statistics add up and reach the per-iteration callback
+def test_search_stats():
+    board = chess.Board("r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15")
+    depths = []
+    agent = main.DeepCrimsonAgent(board, max_depth=3, evaluation_type=main.EvalType.SIMPLE,
+                                  iteration_callback=lambda stats: depths.append(stats.depth))
+    agent.search()
+    stats = agent.stats
+    assert depths == [1, 2, 3]
+    assert stats.nodes + stats.qnodes == sum(stats.depth_nodes) and len(stats.depth_times) == 3
+    assert stats.tt_probes >= stats.tt_hits >= stats.tt_cutoffs > 0
+    assert stats.beta_cutoffs >= stats.first_move_cutoffs > 0
+    assert stats.eval_calls > 0 and stats.ebf() == float(stats.depth_nodes[2]) / stats.depth_nodes[1]
+
+    # a new search starts counting from zero
+    agent.search()
+    assert stats.depth == 3 and len(stats.depth_nodes) == 3
+
+# The tracer sees every negamax node, and its trace survives a save and load
+def test_tracer(tmpdir):
+    board = chess.Board("r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15")
+    agent = main.DeepCrimsonAgent(board, max_depth=3, evaluation_type=main.EvalType.SIMPLE)
+    trace = tracer.Tracer()
+    trace.attach(agent)
+    agent.mtdf_search()
+    trace.detach(agent)
+    summary = tracer.summarize(trace)
+    # the root calls of MTD(f) account for every node searched
+    assert summary['plies'][0][1] == agent.stats.nodes + agent.stats.qnodes
+    assert sum(summary['plies'][0][2]) == sum(agent.mtdf_passes)
+    # '-' is the null move tried at the root
+    assert set(move for move, _, _ in summary['root_moves']) <= set(move.uci() for move in board.legal_moves) | set('-')
+
+    path = str(tmpdir.join("trace.bin"))
+    trace.save(path)
+    loaded = tracer.load(path)
+    assert loaded.events() == trace.events() and tracer.summarize(loaded) == summary
+
+    # a small buffer keeps the last events
+    small = tracer.Tracer(capacity=100)
+    small.attach(agent)
+    agent.mtdf_search()
+    assert small.count > 100 and small.size() == 100
+    assert small.ply[(small.count - 1) % 100] == 0
+
+    searcher = sunfish.Searcher()
+    trace = tracer.Tracer()
+    trace.attach_sunfish(searcher)
+    searcher.search(sunfish.Position(sunfish.initial, 0, (True, True), (True, True), 0, 0), 0.05)
+    assert trace.count == searcher.nodes
+    assert tracer.summarize(trace)['root_moves'][0][0] != '-'
+
+# A second agent attached to the same store file finds the first one's work
+def test_persistent_store(tmpdir):
+    path = str(tmpdir.join("table.bin"))
+    fen = "r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15"
+    cold = main.DeepCrimsonAgent(chess.Board(fen), max_depth=3, evaluation_type=main.EvalType.SIMPLE, table_size=2**12)
+    cold.attach_store(path, eval_size=2**10)
+    move = cold.mtdf_search()
+    cold.flush_store()
+    assert cold.store.eval_hits < cold.store.eval_probes
+
+    warm = main.DeepCrimsonAgent(chess.Board(fen), max_depth=3, evaluation_type=main.EvalType.SIMPLE, table_size=2**12)
+    warm.attach_store(path, eval_size=2**10)
+    assert warm.tt.probe(chess.Board(fen).zobrist_hash())[0] == move
+    assert warm.tt.generation == cold.tt.generation
+    assert warm.mtdf_search() == move
+    assert warm.stats.nodes + warm.stats.qnodes < cold.stats.nodes + cold.stats.qnodes
+    assert warm.stats.eval_cache_hits > 0
+
+    # values of another evaluator are not served: the file is wiped
+    other = main.DeepCrimsonAgent(chess.Board(fen), max_depth=3, table_size=2**12)
+    other.attach_store(path, eval_size=2**10)
+    assert other.tt.probe(chess.Board(fen).zobrist_hash()) is None
+
+    # Lazy SMP helpers write the store under its locks
+    shared = main.DeepCrimsonAgent(chess.Board(fen), max_depth=3, evaluation_type=main.EvalType.SIMPLE,
+                                   table_size=2**12, workers=2)
+    shared.attach_store(path, eval_size=2**10)
+    assert shared.parallel_search() in chess.Board(fen).legal_moves
+    assert not multiprocessing.active_children()
+
+# A ponder hit without a time limit lets the ponder search reach its depth
+def test_pondering():
+    player = play.AgentPlayer(False, depth=3, opening_book=False, mate_solver=False, ponder=True)
+    game = chess.pgn.Game()
+    player.move(game)
+    fen = player._pondering[0]
+    move = player.stop_pondering(chess.Board(fen))
+    assert player.ponder_hits == 1
+    assert move in chess.Board(fen).legal_moves
+    assert player.ponder_depth == 3
+
+# Tests static exchange evaluation on known exchanges, x-rays included
+def test_see():
+    exchanges = [("1k1r4/1pp4p/p7/4p3/8/P5P1/1PP4P/2K1R3 w - - 0 1", "e1e5", 100),
+                 ("1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1", "d3e5", -200),
+                 # the rook behind the capturing rook recaptures
+                 ("4r1k1/8/8/4p3/8/8/4R3/4R1K1 w - - 0 1", "e2e5", 100),
+                 ("4r1k1/8/8/4p3/8/8/4R3/6K1 w - - 0 1", "e2e5", -400),
+                 ("4k3/8/2b5/3r4/8/8/3R4/3QK3 w - - 0 1", "d2d5", 300),
+                 ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5d6", 100),
+                 ("1r2k3/P7/8/8/8/8/8/4K3 w - - 0 1", "a7a8q", -100)]
+    for fen, uci, value in exchanges:
+        assert see.see(chess.Board(fen), chess.Move.from_uci(uci)) == value
+
+    # the losing capture is ordered after the quiet moves
+    board = chess.Board("1k1r3q/1ppn3p/p4b2/4p3/8/P2N2P1/1PP1R1BP/2K1Q3 w - - 0 1")
+    moves = ordering.MoveOrderer().order(board, board.legal_moves, 0)
+    quiet = [i for i, move in enumerate(moves) if not board.is_capture(move)]
+    assert moves.index(chess.Move.from_uci("d3e5")) > max(quiet)
+
+# The mate solver proves the tactics' mates and refutes positions without one
+def test_mate_solver():
+    board = chess.Board("1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1")
+    solver = pns.MateSolver()
+    assert solver.solve(board) == pns.MateResult.PROVEN
+    assert solver.move == chess.Move.from_uci("d6d1") and solver.mate_plies == len(solver.pv)
+    for move in solver.pv:
+        board.push(move)
+    assert board.is_checkmate()
+
+    # a back-rank mate in one, and no mate in one ply less
+    board = chess.Board("6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1")
+    assert pns.MateSolver(max_plies=1).solve(board) == pns.MateResult.PROVEN
+    solver = pns.MateSolver(max_plies=2)
+    assert solver.solve(chess.Board("6k1/5ppp/8/8/8/8/5PPP/5RK1 w - - 0 1")) == pns.MateResult.DISPROVEN
+    assert pns.MateSolver().solve(chess.Board("8/8/8/8/8/5k2/8/5K2 w - - 0 1")) == pns.MateResult.DISPROVEN
+
+    # the node table bounds the search
+    solver = pns.MateSolver(max_nodes=200)
+    assert solver.solve(chess.Board("r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15")) == pns.MateResult.UNKNOWN
+    assert solver.size >= 200
+
+    # an agent only runs the solver when asked to, and within its time per move
+    assert play.AgentPlayer(False)._solver is None
+    board = chess.Board("r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3")
+    player = play.AgentPlayer(False, depth=20, opening_book=False, max_time=1.0, mate_solver=True)
+    player._agent.board = board
+    t0 = time.time()
+    assert player.search(board) in board.legal_moves
+    assert time.time() - t0 < 1.1
+
+# positions from short random games out of the tactics and the starting
+# position, covering all three game phases
+def eval_corpus(games=2, plies=60):
+    rng = random.Random(182)
+    boards = []
+    for fen in bench.BENCH_FENS + [chess.STARTING_FEN]:
+        for _ in range(games):
+            board = chess.Board(fen)
+            for _ in range(plies):
+                moves = list(board.legal_moves)
+                if not moves:
+                    break
+                board.push(rng.choice(moves))
+                boards.append(board.copy())
+    return boards
+
+
+# The single-pass feature extractor scores exactly like the per-phase evals
+def test_eval_features():
+    e = Evaluator(cache=transposition.EvalCache(2**12))
+    for board in eval_corpus():
+        majors = e.num_major_pieces(board)
+        if majors > 12:
+            expected = e.openinggame_eval(board)
+        elif majors > 7:
+            expected = e.middlegame_eval(board)
+        else:
+            expected = e.endgame_eval(board)
+        e.cache.clear()
+        assert e.evaluate(board, check_terminal=False) == expected
+        assert e.evaluate(searchboard.SearchBoard.from_board(board), check_terminal=False) == expected
+
+
+# The evaluation cache is shared, bounded and keyed by the zobrist key, and
+# the pawn hash table by the pawns' key
+def test_eval_cache():
+    cache = transposition.EvalCache(4 * transposition.EVAL_ENTRY_BYTES)
+    assert cache.size == 4 and cache.memory_bytes() <= 4 * transposition.EVAL_ENTRY_BYTES
+    # keys 0, 2 and 4 share a bucket: the least recently used one is evicted
+    cache.store(2, 1.5)
+    cache.store(4, -0.5)
+    assert cache.probe(2) == 1.5
+    cache.store(0, 3.0)
+    assert cache.probe(4) is None and cache.evictions == 1
+    assert cache.probe(2) == 1.5 and cache.probe(0) == 3.0
+    assert (cache.hits, cache.misses) == (3, 1)
+    # an evaluation made without testing for the end of the game does not
+    # answer a probe that needs the test
+    assert cache.probe(0, checked=True) is None
+    cache.store(0, 3.0, checked=True)
+    assert cache.probe(0, checked=True) == 3.0
+
+    # evaluators share the process-wide cache, whatever their units
+    board = chess.Board("r1b1k1r1/p1pq1p2/1p1p1npp/3Pp3/2P4N/2PBP3/P1Q2PPP/R4RK1 b q - 3 15")
+    first = Evaluator()
+    second = Evaluator(centipawns=True)
+    assert first.cache is second.cache is evaluator.shared_eval_cache()
+    score = first.evaluate(board)
+    hits = second.cache_hits
+    assert second.evaluate(board) == int(round(score * 100)) and second.cache_hits == hits + 1
+    assert first.evaluate(board) == score
+    mate = chess.Board("r1bqkb1r/pppp1Qpp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4")
+    assert first.evaluate(mate) == float("inf") and second.evaluate(mate) == evaluator.MATE_SCORE
+
+    # draws by the move history are not cached for the same position reached
+    # with a fresh clock or another history, nor the other way around
+    e = Evaluator(cache=transposition.EvalCache(2**12))
+    fen = "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - %d 100"
+    score = e.evaluate(chess.Board(fen % 0))
+    assert score > 0
+    assert e.evaluate(chess.Board(fen % 150)) == 0 and e.evaluate(chess.Board(fen % 0)) == score
+    e.cache.clear()
+    repeated = chess.Board(fen % 0)
+    for uci in ["a1a2", "g8h8", "a2a1", "h8g8"] * 4:
+        repeated.push(chess.Move.from_uci(uci))
+    assert e.evaluate(repeated) == 0 and e.evaluate(chess.Board(fen % 0)) == score
+
+    # the pawn hash table answers positions that only differ in their pieces
+    table = first.pawn_table
+    hits = table.hits
+    board.push(chess.Move.from_uci("g8h8"))
+    first.evaluate(board)
+    assert table.hits == hits + 1 and table.evictions == 0
+    assert transposition.PawnHashTable(1000).memory_bytes() == 1000 * transposition.PAWN_ENTRY_BYTES
+
+
+# The NumPy batch evaluation scores exactly like Evaluator.evaluate
+def test_batch_eval():
+    pytest.importorskip("numpy")
+    import batch
+    boards = eval_corpus() + [chess.Board("QQQQQQQQ/QQQQQQQQ/QQQQQQQQ/QQQQQQQQ/QQQ1QQQQ/QQQQQQQQ/NNNNNNNN/k6K w - - 0 1"),
+                              chess.Board("r1bqkb1r/pppp1Qpp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4")]
+    for centipawns in [False, True]:
+        e = Evaluator(centipawns=centipawns, cache=transposition.EvalCache(2**12))
+        assert list(batch.evaluate_batch(boards, centipawns=centipawns)) == [e.evaluate(board) for board in boards]
+    e = Evaluator(cache=transposition.EvalCache(2**12))
+    static = batch.evaluate_bitboards(batch.pack(boards))
+    assert list(static) == [e.evaluate(board, check_terminal=False) for board in boards]
+    assert batch.planes(batch.pack(boards[:3])).shape == (3, 12, 64)
+
+
+# Mobility from attack-count maps matches counting board.attackers per square
+def test_mobility():
+    e = Evaluator()
+    # a knight and queen pile-up, and more attackers than squares around a king
+    boards = eval_corpus() + [chess.Board("8/8/8/3q4/2N1N3/1Q3Q2/2N1N3/k3K3 w - - 0 1"),
+                              chess.Board("QQQQQQQQ/QQQQQQQQ/QQQQQQQQ/QQQQQQQQ/QQQ1QQQQ/QQQQQQQQ/NNNNNNNN/k6K w - - 0 1")]
+    for board in boards:
+        controlled = {}
+        for color in chess.COLORS:
+            controlled[color] = sum(1 for square in chess.SQUARES
+                                    if len(board.attackers(color, square)) > len(board.attackers(not color, square)))
+            assert e.num_controlled_squares(board, color) == controlled[color]
+        assert e.mob_eval(board, chess.WHITE) == controlled[chess.WHITE] - controlled[chess.BLACK]
+        assert e.mob_eval(board, chess.BLACK) == controlled[chess.BLACK] - controlled[chess.WHITE]
+
+
 # Various assertion tests for the evaluation functionality
 def test_eval():
     e = Evaluator(verbose=False)
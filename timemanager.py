@@ -0,0 +1,97 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# timemanager.py
+# This file has the time manager that stops our agents' searches on a
+# per-move deadline, a chess clock with increment or a node budget.
+
+from timeit import default_timer as timer
+
+# number of nodes searched between two reads of the clock (a Python node
+# costs far more than reading the clock, and complex evaluations are slow)
+CHECK_INTERVAL = 16
+
+# moves assumed to be left in the game when the clock does not say
+DEFAULT_MOVES_TO_GO = 30
+
+# seconds always kept on the clock so we never flag
+SAFETY_MARGIN = 0.05
+
+# a new iteration is only started while less than this share of the budget is used
+ITERATION_FRACTION = 0.5
+
+
+# raised inside the search once the deadline or node budget is exhausted
+class SearchTimeout(Exception):
+    pass
+
+
+class TimeManager():
+    def __init__(self, max_time=None, max_nodes=None, stop_flag=None):
+        # fixed seconds per move and total nodes per move, None for no limit
+        self.max_time = max_time
+        self.max_nodes = max_nodes
+
+        # optional shared multiprocessing value another process sets to stop us
+        self.stop_flag = stop_flag
+
+        self.budget = None
+        self.start_time = timer()
+        self.deadline = None
+        self.base_nodes = 0
+        self.next_check = float("inf")
+
+    # starts timing a new move, optionally from the remaining clock and increment
+    def start(self, clock=None, increment=0, moves_to_go=None):
+        budget = self.max_time
+        if clock is not None:
+            if moves_to_go is None:
+                moves_to_go = DEFAULT_MOVES_TO_GO
+            clock_budget = clock / float(moves_to_go) + increment
+            clock_budget = max(0.0, min(clock_budget, clock - SAFETY_MARGIN))
+            if budget is None or clock_budget < budget:
+                budget = clock_budget
+
+        self.budget = budget
+        self.start_time = timer()
+        self.deadline = None if budget is None else self.start_time + budget
+        self.base_nodes = 0
+        self.new_iteration(0)
+
+    # whether a search is running under any limit at all
+    def is_limited(self):
+        return self.deadline is not None or self.max_nodes is not None or self.stop_flag is not None
+
+    # seconds since the search started
+    def elapsed(self):
+        return timer() - self.start_time
+
+    # the agent resets its node counters every iteration, so the nodes of the
+    # finished iteration are banked here and the next check is rescheduled
+    def new_iteration(self, nodes):
+        self.base_nodes += nodes
+        if not self.is_limited():
+            self.next_check = float("inf")
+            return
+        self.next_check = CHECK_INTERVAL
+        if self.max_nodes is not None:
+            self.next_check = min(self.next_check, self.max_nodes - self.base_nodes)
+
+    # called by the search when its node count reaches next_check
+    def check(self, nodes):
+        total = self.base_nodes + nodes
+        if self.max_nodes is not None and total >= self.max_nodes:
+            raise SearchTimeout()
+        if self.deadline is not None and timer() >= self.deadline:
+            raise SearchTimeout()
+        if self.stop_flag is not None and self.stop_flag.value:
+            raise SearchTimeout()
+        self.next_check = nodes + CHECK_INTERVAL
+        if self.max_nodes is not None:
+            self.next_check = min(self.next_check, self.max_nodes - self.base_nodes)
+
+    # whether there is likely enough time left to finish another iteration
+    def can_start_iteration(self):
+        if self.max_nodes is not None and self.base_nodes >= self.max_nodes:
+            return False
+        if self.budget is None:
+            return True
+        return self.elapsed() < self.budget * ITERATION_FRACTION
@@ -0,0 +1,273 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# tracer.py
+# This file has an opt-in tracer for diagnosing searches that blow up. Once
+# attached to a DeepCrimsonAgent (or a Sunfish Searcher) it records one event
+# per node of negamax_value (Searcher.bound): ply, move, window, result, depth,
+# subtree size, why the node ended and whether the transposition table had an
+# entry. Events go to a fixed-size ring buffer of typed arrays that can be
+# saved to a compact file and summarized by ply and by root move, e.g.
+# python tracer.py trace.bin
+# Searches without a tracer attached run the unmodified methods.
+
+from array import array
+import struct
+import sys
+
+import sunfish
+from transposition import encode_move, decode_move
+
+# default number of events kept: the last ones of the search
+DEFAULT_CAPACITY = 2**16
+
+# file header: magic, format version, move encoding, events recorded in total
+# and events stored
+MAGIC = 'DCTRACE\0'
+VERSION = 1
+HEADER = struct.Struct('<8sHBxQQ')
+
+# how moves are encoded: transposition.encode_move for python-chess moves, and
+# from | to << 7 on the 120-square board for Sunfish moves
+CHESS_MOVES = 0
+SUNFISH_MOVES = 1
+
+# the flag byte holds the reason in its low bits and the TT hit above
+TT_HIT_FLAG = 8
+
+# the arrays of an event, in file order
+FIELDS = [('ply', 'B'), ('move', 'H'), ('root_move', 'H'), ('depth', 'b'), ('alpha', 'd'), ('beta', 'd'),
+          ('value', 'd'), ('nodes', 'L'), ('flags', 'B')]
+
+
+class TraceReason:
+    EXACT = 0       # searched, value inside the window
+    FAIL_LOW = 1    # searched, no move reached alpha
+    BETA = 2        # a move caused a beta cutoff
+    TT = 3          # the transposition table entry ended the node
+    NULL_MOVE = 4   # passing failed high
+    TERMINAL = 5    # draw, mate or stalemate, nothing searched
+    LEAF = 6        # depth 0: quiescence or the evaluation
+
+REASON_NAMES = ['exact', 'fail-low', 'beta', 'tt', 'null-move', 'terminal', 'leaf']
+
+
+class Tracer():
+    def __init__(self, capacity=DEFAULT_CAPACITY, moves=CHESS_MOVES):
+        self.capacity = capacity
+        self.moves = moves
+        for name, typecode in FIELDS:
+            setattr(self, name, array(typecode, [0]) * capacity)
+        # events recorded in total; the buffer keeps the last capacity of them
+        self.count = 0
+        # events a loaded trace lost to the ring buffer before it was saved
+        self.dropped = 0
+
+        # per active node: TT hits, TT cutoffs and beta cutoffs of the children's
+        # subtrees, number of children and whether one was a null move
+        self.frames = []
+        self.root_code = 0
+
+    # traces agent.negamax_value until detach(agent)
+    def attach(self, agent):
+        negamax_value = agent.negamax_value
+        frames = self.frames
+        stats = agent.stats
+
+        def traced(depth, alpha, beta, color, ply=0, null_allowed=True):
+            before = (stats.tt_hits, stats.tt_cutoffs, stats.beta_cutoffs, agent.nodes + agent.qnodes)
+            frame = [0, 0, 0, 0, False]
+            frames.append(frame)
+            try:
+                value = negamax_value(depth, alpha, beta, color, ply, null_allowed)
+            finally:
+                frames.pop()
+            hits = stats.tt_hits - before[0]
+            tt_cutoffs = stats.tt_cutoffs - before[1]
+            beta_cutoffs = stats.beta_cutoffs - before[2]
+
+            move = None
+            root_move = None
+            if ply > 0:
+                move_stack = agent.board.move_stack
+                move = move_stack[-1]
+                root_move = move_stack[len(move_stack) - ply]
+            if frames:
+                parent = frames[-1]
+                parent[0] += hits
+                parent[1] += tt_cutoffs
+                parent[2] += beta_cutoffs
+                parent[3] += 1
+                if not move:
+                    parent[4] = True
+
+            if depth == 0:
+                reason = TraceReason.LEAF
+            elif tt_cutoffs > frame[1]:
+                reason = TraceReason.TT
+            elif beta_cutoffs > frame[2]:
+                reason = TraceReason.BETA
+            elif frame[4] and frame[3] == 1 and value >= beta:
+                reason = TraceReason.NULL_MOVE
+            elif frame[3] == 0:
+                reason = TraceReason.TERMINAL
+            elif value <= alpha:
+                reason = TraceReason.FAIL_LOW
+            else:
+                reason = TraceReason.EXACT
+            self.record(ply, encode_move(move), encode_move(root_move), depth, alpha, beta, value,
+                        agent.nodes + agent.qnodes - before[3], reason, hits > frame[0])
+            return value
+
+        agent.negamax_value = traced
+
+    # restores the agent's own negamax_value
+    def detach(self, agent):
+        del agent.negamax_value
+
+    # traces searcher.bound of a Sunfish Searcher; the window is (gamma - 1,
+    # gamma) and moves are only known at the root's children
+    def attach_sunfish(self, searcher):
+        bound = searcher.bound
+        frames = self.frames
+
+        def traced(pos, gamma, depth, root=True):
+            nodes = searcher.nodes
+            ply = len(frames)
+            if ply == 1:
+                root_pos = frames[0][1]
+                self.root_code = 0
+                for move in root_pos.gen_moves():
+                    if root_pos.move(move) == pos:
+                        self.root_code = move[0] | move[1] << 7
+                        break
+            frame = [0, pos]
+            frames.append(frame)
+            try:
+                value = bound(pos, gamma, depth, root)
+            finally:
+                frames.pop()
+            if frames:
+                frames[-1][0] += 1
+
+            if depth <= 0:
+                reason = TraceReason.LEAF
+            elif pos.score <= -sunfish.MATE_LOWER:
+                reason = TraceReason.TERMINAL
+            elif frame[0] == 0:
+                reason = TraceReason.TT
+            elif value >= gamma:
+                reason = TraceReason.BETA
+            else:
+                reason = TraceReason.FAIL_LOW
+            code = self.root_code if ply == 1 else 0
+            self.record(ply, code, self.root_code if ply > 0 else 0, depth, gamma - 1, gamma, value,
+                        searcher.nodes - nodes, reason, False)
+            return value
+
+        self.moves = SUNFISH_MOVES
+        searcher.bound = traced
+
+    def detach_sunfish(self, searcher):
+        del searcher.bound
+
+    # appends an event to the ring buffer
+    def record(self, ply, move, root_move, depth, alpha, beta, value, nodes, reason, tt_hit):
+        i = self.count % self.capacity
+        self.ply[i] = min(ply, 255)
+        self.move[i] = move
+        self.root_move[i] = root_move
+        self.depth[i] = max(-128, min(depth, 127))
+        self.alpha[i] = alpha
+        self.beta[i] = beta
+        self.value[i] = value
+        self.nodes[i] = nodes
+        self.flags[i] = reason | (TT_HIT_FLAG if tt_hit else 0)
+        self.count += 1
+
+    # number of events held by the buffer
+    def size(self):
+        return min(self.count, self.capacity)
+
+    # buffer indices of the held events, oldest first
+    def indices(self):
+        if self.count <= self.capacity:
+            return range(self.count)
+        start = self.count % self.capacity
+        return range(start, self.capacity) + range(start)
+
+    # the held events as dictionaries, oldest first
+    def events(self):
+        return [dict((name, getattr(self, name)[i]) for name, _ in FIELDS) for i in self.indices()]
+
+    # readable form of an encoded move
+    def move_name(self, code):
+        if code == 0:
+            return '-'
+        if self.moves == SUNFISH_MOVES:
+            return sunfish.render(code & 127) + sunfish.render(code >> 7)
+        return decode_move(code).uci()
+
+    # writes the held events to path, oldest first
+    def save(self, path):
+        indices = self.indices()
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.moves, self.count, len(indices)))
+            for name, typecode in FIELDS:
+                column = getattr(self, name)
+                array(typecode, (column[i] for i in indices)).tofile(f)
+
+
+# reads a trace written by Tracer.save
+def load(path):
+    with open(path, 'rb') as f:
+        magic, version, moves, count, size = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d trace" % (path, VERSION))
+        tracer = Tracer(capacity=max(size, 1), moves=moves)
+        for name, typecode in FIELDS:
+            column = array(typecode)
+            column.fromfile(f, size)
+            if size:
+                setattr(tracer, name, column)
+    tracer.count = size
+    tracer.dropped = count - size
+    return tracer
+
+
+# events, subtree nodes and reasons per ply, and events and nodes per root move
+# (subtree nodes of the root's children, heaviest first)
+def summarize(tracer):
+    plies = {}
+    root_moves = {}
+    for i in tracer.indices():
+        ply = tracer.ply[i]
+        row = plies.setdefault(ply, [0, 0, [0] * len(REASON_NAMES), 0])
+        row[0] += 1
+        row[1] += tracer.nodes[i]
+        row[2][tracer.flags[i] & (TT_HIT_FLAG - 1)] += 1
+        if tracer.flags[i] & TT_HIT_FLAG:
+            row[3] += 1
+        if ply >= 1:
+            totals = root_moves.setdefault(tracer.move_name(tracer.root_move[i]), [0, 0])
+            totals[0] += 1
+            if ply == 1:
+                totals[1] += tracer.nodes[i]
+    return {'plies': plies,
+            'root_moves': sorted(((move, events, nodes) for move, (events, nodes) in root_moves.items()),
+                                 key=lambda row: row[2], reverse=True)}
+
+
+def print_summary(tracer, top=10):
+    summary = summarize(tracer)
+    print "%d events held" % tracer.size()
+    print "ply    events  subtree nodes  tt hits  " + " ".join("%9s" % name for name in REASON_NAMES)
+    for ply in sorted(summary['plies']):
+        events, nodes, reasons, hits = summary['plies'][ply]
+        print "%3d %9d %14d %8d  " % (ply, events, nodes, hits) + " ".join("%9d" % n for n in reasons)
+    print
+    print "root move    events  subtree nodes"
+    for move, events, nodes in summary['root_moves'][:top]:
+        print "%-9s %9d %14d" % (move, events, nodes)
+
+
+if __name__ == '__main__':
+    print_summary(load(sys.argv[1]))
@@ -0,0 +1,426 @@
+# CS182 Deep Crimson: Matthew Beatty and Akshay Saini
+# transposition.py
+# This file has the packed transposition table used by our search agents.
+# Entries live in parallel typed arrays instead of one Python object per
+# entry, and are grouped into buckets so deep entries survive shallow ones.
+# A table can also live in a memory-mapped file that outlasts the agent.
+
+from array import array
+import ctypes
+import mmap
+import os
+import struct
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray, typecode_to_type
+import chess
+
+# number of slots per bucket: every slot but the last is depth-preferred,
+# the last slot is always replaced
+BUCKET_SIZE = 4
+
+# generations are stored in the high 6 bits of the flag byte
+GENERATION_BITS = 6
+GENERATION_MASK = (1 << GENERATION_BITS) - 1
+
+# how many plies of depth one generation of age is worth when picking a victim
+AGE_WEIGHT = 8
+
+# bytes used by one entry: key, move, depth, value and flags
+ENTRY_BYTES = 8 + 2 + 1 + 8 + 1
+
+# number of locks striped over the buckets of a table shared between processes
+LOCK_STRIPES = 64
+
+# header of a persistent table file: magic, format version, table slots,
+# evaluation slots, bucket size, generation and the evaluation tag; the
+# arrays follow at FILE_HEADER_BYTES, each aligned to 8 bytes
+FILE_MAGIC = 'DCTTABLE'
+FILE_VERSION = 1
+FILE_HEADER = struct.Struct('<8sHQQHB32s')
+FILE_HEADER_BYTES = 128
+
+# default number of evaluations kept by a persistent table
+EVAL_SIZE = 2**18
+
+# bytes used by one evaluation cache entry: key, value and flags
+EVAL_ENTRY_BYTES = 8 + 8 + 1
+
+# default memory budget of an evaluation cache
+EVAL_CACHE_BYTES = 2**23
+
+# evaluation cache flags: the slot is in use, and the position was tested for
+# the end of the game before it was evaluated
+EVAL_USED = 1
+EVAL_CHECKED = 2
+
+# default number of entries of a pawn hash table
+PAWN_TABLE_SIZE = 2**14
+
+# bytes used by one pawn hash table entry: key, structure score, the king
+# square and pawn shield of each color, and the used flag
+PAWN_ENTRY_BYTES = 8 + 1 + 2 * (1 + 1) + 1
+
+
+# bytes rounded up to a multiple of 8
+def aligned(nbytes):
+    return (nbytes + 7) // 8 * 8
+
+
+# packs a chess.Move into 16 bits (0 means no move, since a1a1 is never a move)
+def encode_move(move):
+    if move is None:
+        return 0
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+# unpacks a 16 bit move produced by encode_move
+def decode_move(code):
+    if code == 0:
+        return None
+    return chess.Move(code & 63, (code >> 6) & 63, (code >> 12) or None)
+
+
+class TranspositionTable():
+    def __init__(self, size=2**20):
+        # round the table down to a whole number of buckets
+        self.num_buckets = max(1, size // BUCKET_SIZE)
+        self.size = self.num_buckets * BUCKET_SIZE
+
+        # parallel arrays holding the packed entries
+        self.keys = self.allocate('L')
+        self.moves = self.allocate('H')
+        self.depths = self.allocate('b')
+        self.values = self.allocate('d')
+        # node type in the low 2 bits (0 marks an empty slot), generation above
+        self.flags = self.allocate('B')
+
+        self.generation = 0
+
+    # returns a zeroed array of the given typecode with one item per slot
+    def allocate(self, typecode):
+        return array(typecode, [0]) * self.size
+
+    # number of bytes used by the entry arrays
+    def memory_bytes(self):
+        return self.size * ENTRY_BYTES
+
+    # empties the table
+    def clear(self):
+        for i in range(self.size):
+            self.keys[i] = 0
+            self.flags[i] = 0
+        self.generation = 0
+
+    # ages every stored entry by one search; called before each new search
+    def new_search(self):
+        self.generation = (self.generation + 1) & GENERATION_MASK
+
+    # returns (best_move, depth, value, node_type) for key, or None on a miss
+    def probe(self, key):
+        base = (key % self.num_buckets) * BUCKET_SIZE
+        for i in range(base, base + BUCKET_SIZE):
+            if self.keys[i] == key and self.flags[i]:
+                return decode_move(self.moves[i]), self.depths[i], self.values[i], self.flags[i] & 3
+        return None
+
+    # stores an entry, preferring to keep deep entries from the current search
+    def store(self, key, best_move, depth, value, node_type):
+        base = (key % self.num_buckets) * BUCKET_SIZE
+        generation = self.generation
+        code = encode_move(best_move)
+
+        # the same position is always overwritten in place
+        for i in range(base, base + BUCKET_SIZE):
+            if self.keys[i] == key and self.flags[i]:
+                if code == 0:
+                    code = self.moves[i]
+                self._write(i, key, code, depth, value, node_type | (generation << 2))
+                return
+
+        # otherwise pick the least valuable depth-preferred slot, counting age against it
+        victim = base
+        victim_score = None
+        for i in range(base, base + BUCKET_SIZE - 1):
+            if not self.flags[i]:
+                victim = i
+                victim_score = None
+                break
+            age = (generation - (self.flags[i] >> 2)) & GENERATION_MASK
+            score = self.depths[i] - AGE_WEIGHT * age
+            if victim_score is None or score < victim_score:
+                victim = i
+                victim_score = score
+
+        # a shallower entry cannot displace it and goes to the always-replace slot
+        if victim_score is not None and victim_score > depth:
+            victim = base + BUCKET_SIZE - 1
+
+        self._write(victim, key, code, depth, value, node_type | (generation << 2))
+
+    def _write(self, i, key, code, depth, value, flags):
+        self.keys[i] = key
+        self.moves[i] = code
+        self.depths[i] = depth
+        self.values[i] = value
+        self.flags[i] = flags
+
+    # approximate number of used slots per thousand, sampled from the first buckets
+    def hashfull(self):
+        sample = min(self.size, 1000)
+        used = 0
+        for i in range(sample):
+            if self.flags[i] and (self.flags[i] >> 2) == self.generation:
+                used += 1
+        return used * 1000 // sample
+
+
+# a transposition table living in shared memory, for worker processes forked
+# after it is created; every bucket is guarded by one of a few striped locks
+class SharedTranspositionTable(TranspositionTable):
+    def __init__(self, size=2**20):
+        self.locks = [multiprocessing.Lock() for _ in range(LOCK_STRIPES)]
+        TranspositionTable.__init__(self, size)
+
+    def allocate(self, typecode):
+        return RawArray(typecode, self.size)
+
+    def probe(self, key):
+        with self.locks[(key % self.num_buckets) % LOCK_STRIPES]:
+            return TranspositionTable.probe(self, key)
+
+    def store(self, key, best_move, depth, value, node_type):
+        with self.locks[(key % self.num_buckets) % LOCK_STRIPES]:
+            TranspositionTable.store(self, key, best_move, depth, value, node_type)
+
+
+# a transposition table and evaluation cache in a fixed-size file mapped into
+# memory, so positions searched by one agent are found by the next one, e.g.
+# across the games of play_games; tag names what the stored values mean (the
+# evaluator and its units), and a file with another tag, version or size is
+# wiped. Entries reach the disk when flush is called or the OS writes them back.
+# The mapping is shared with forked processes, so it takes the striped locks of
+# SharedTranspositionTable around every entry it reads or writes
+class PersistentTranspositionTable(TranspositionTable):
+    def __init__(self, path, size=2**20, eval_size=EVAL_SIZE, tag=''):
+        self.path = path
+        self.tag = tag
+        self.locks = [multiprocessing.Lock() for _ in range(LOCK_STRIPES)]
+        slots = max(1, size // BUCKET_SIZE) * BUCKET_SIZE
+        self.eval_size = max(1, eval_size)
+        header = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, slots, self.eval_size, BUCKET_SIZE, 0, tag)
+        file_bytes = FILE_HEADER_BYTES + sum(aligned(slots * itemsize) for itemsize in [8, 2, 1, 8, 1]) \
+            + 2 * aligned(8 * self.eval_size)
+
+        # reuse the file when it was written with the same layout and tag
+        self.file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        old_header = self.file.read(FILE_HEADER.size)
+        fresh = len(old_header) != FILE_HEADER.size or os.path.getsize(path) != file_bytes
+        if not fresh:
+            # everything but the generation has to match
+            old_fields = FILE_HEADER.unpack(old_header)
+            fields = FILE_HEADER.unpack(header)
+            fresh = old_fields[:5] != fields[:5] or old_fields[6] != fields[6]
+        if fresh:
+            self.file.seek(0)
+            self.file.truncate(0)
+            self.file.truncate(file_bytes)
+        self.map = mmap.mmap(self.file.fileno(), file_bytes)
+        self.offset = FILE_HEADER_BYTES
+
+        TranspositionTable.__init__(self, size)
+        self.eval_keys = self.allocate('L', self.eval_size)
+        self.eval_values = self.allocate('d', self.eval_size)
+
+        if fresh:
+            self.map[:FILE_HEADER.size] = header
+        else:
+            self.generation = FILE_HEADER.unpack(old_header)[5]
+
+        # evaluation lookups, and those answered by the file
+        self.eval_probes = 0
+        self.eval_hits = 0
+
+    # carves the next array out of the mapped file
+    def allocate(self, typecode, count=None):
+        if count is None:
+            count = self.size
+        ctype = typecode_to_type[typecode]
+        values = (ctype * count).from_buffer(self.map, self.offset)
+        self.offset += aligned(count * ctypes.sizeof(ctype))
+        return values
+
+    def memory_bytes(self):
+        return self.size * ENTRY_BYTES + self.eval_size * 16
+
+    def probe(self, key):
+        with self.locks[(key % self.num_buckets) % LOCK_STRIPES]:
+            return TranspositionTable.probe(self, key)
+
+    def store(self, key, best_move, depth, value, node_type):
+        with self.locks[(key % self.num_buckets) % LOCK_STRIPES]:
+            TranspositionTable.store(self, key, best_move, depth, value, node_type)
+
+    def clear(self):
+        TranspositionTable.clear(self)
+        for i in range(self.eval_size):
+            self.eval_keys[i] = 0
+
+    # stored evaluation of the position with zobrist key, or None
+    def probe_eval(self, key):
+        self.eval_probes += 1
+        i = key % self.eval_size
+        with self.locks[i % LOCK_STRIPES]:
+            if self.eval_keys[i] != key or not key:
+                return None
+            value = self.eval_values[i]
+        self.eval_hits += 1
+        return value
+
+    # stores an evaluation, replacing whatever shared its slot
+    def store_eval(self, key, value):
+        i = key % self.eval_size
+        with self.locks[i % LOCK_STRIPES]:
+            self.eval_keys[i] = key
+            self.eval_values[i] = value
+
+    # writes the generation and every changed page to the file
+    def flush(self):
+        self.map[:FILE_HEADER.size] = FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, self.size, self.eval_size,
+                                                       BUCKET_SIZE, self.generation, self.tag)
+        self.map.flush()
+
+
+# a fixed-size cache of static evaluations keyed by zobrist key, within a byte
+# budget; each key maps to a bucket of two slots kept in least recently used
+# order, so a new position evicts the older of the two
+class EvalCache():
+    def __init__(self, max_bytes=EVAL_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.num_buckets = max(1, max_bytes // (2 * EVAL_ENTRY_BYTES))
+        self.size = 2 * self.num_buckets
+        self.clear()
+
+    def memory_bytes(self):
+        return self.size * EVAL_ENTRY_BYTES
+
+    # empties the cache and its counters
+    def clear(self):
+        self.keys = array('L', [0]) * self.size
+        self.values = array('d', [0]) * self.size
+        self.flags = array('B', [0]) * self.size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit_rate(self):
+        if self.hits + self.misses == 0:
+            return 0.0
+        return float(self.hits) / (self.hits + self.misses)
+
+    # cached evaluation of the position with key, or None; with checked, only
+    # an evaluation made after testing for the end of the game will do
+    def probe(self, key, checked=False):
+        i = (key % self.num_buckets) * 2
+        keys = self.keys
+        flags = self.flags
+        if keys[i] == key and flags[i] and (not checked or flags[i] & EVAL_CHECKED):
+            self.hits += 1
+            return self.values[i]
+        j = i + 1
+        if keys[j] == key and flags[j] and (not checked or flags[j] & EVAL_CHECKED):
+            self.hits += 1
+            # the slot becomes the most recently used one
+            value = self.values[j]
+            self._swap(i, j)
+            return value
+        self.misses += 1
+        return None
+
+    # stores an evaluation as the most recently used entry of its bucket
+    def store(self, key, value, checked=False):
+        i = (key % self.num_buckets) * 2
+        j = i + 1
+        flags = self.flags
+        if not (self.keys[i] == key and flags[i]):
+            # the older entry (or this key's own one) makes room
+            if flags[j] and self.keys[j] != key:
+                self.evictions += 1
+            self.keys[j] = self.keys[i]
+            self.values[j] = self.values[i]
+            flags[j] = flags[i]
+        self.keys[i] = key
+        self.values[i] = value
+        flags[i] = EVAL_USED | (EVAL_CHECKED if checked else 0)
+
+    def _swap(self, i, j):
+        keys = self.keys
+        values = self.values
+        flags = self.flags
+        keys[i], keys[j] = keys[j], keys[i]
+        values[i], values[j] = values[j], values[i]
+        flags[i], flags[j] = flags[j], flags[i]
+
+
+# a direct-mapped table of pawn structure evaluations keyed by the zobrist key
+# of the pawns alone, which few moves of a search change. An entry holds the
+# structure score and, for each color, the pawn shield of the last king square
+# it was asked for (-1 before that)
+class PawnHashTable():
+    def __init__(self, size=PAWN_TABLE_SIZE):
+        self.size = max(1, size)
+        self.clear()
+
+    def memory_bytes(self):
+        return self.size * PAWN_ENTRY_BYTES
+
+    # empties the table and its counters
+    def clear(self):
+        self.keys = array('L', [0]) * self.size
+        self.structure = array('b', [0]) * self.size
+        self.kings = [array('b', [-1]) * self.size, array('b', [-1]) * self.size]
+        self.shields = [array('B', [0]) * self.size, array('B', [0]) * self.size]
+        self.used = array('B', [0]) * self.size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shield_hits = 0
+        self.shield_misses = 0
+
+    def hit_rate(self):
+        if self.hits + self.misses == 0:
+            return 0.0
+        return float(self.hits) / (self.hits + self.misses)
+
+    # slot of the pawn structure with key, or None
+    def probe(self, key):
+        i = key % self.size
+        if self.keys[i] == key and self.used[i]:
+            self.hits += 1
+            return i
+        self.misses += 1
+        return None
+
+    # stores the structure score of the pawns with key, replacing whatever
+    # held the slot, and returns the slot
+    def store(self, key, structure):
+        i = key % self.size
+        if self.used[i] and self.keys[i] != key:
+            self.evictions += 1
+        self.keys[i] = key
+        self.structure[i] = structure
+        self.kings[0][i] = -1
+        self.kings[1][i] = -1
+        self.used[i] = 1
+        return i
+
+    # pawn shield of color's king on king in slot i, or None
+    def shield(self, i, color, king):
+        if self.kings[color][i] == king:
+            self.shield_hits += 1
+            return self.shields[color][i]
+        self.shield_misses += 1
+        return None
+
+    def store_shield(self, i, color, king, shield):
+        self.kings[color][i] = king
+        self.shields[color][i] = shield